@@ -0,0 +1,423 @@
+"""Benchmarks for the judge scoreboard renderer
+
+Runs headless against the bundled scoreboard templates and flags, and times the
+image hot path: ScoreboardMaker.create_scoreboard(), TextDraw.draw_header_text(),
+TextDraw.draw_text_on_image(), FlagDraw.overlay_flag() and
+ImageUtil.paste_centered(). From the folder that contains the cog:
+
+    python -m judge.benchmark
+    python -m judge.benchmark --output before.json
+    python -m judge.benchmark --output after.json --compare before.json
+
+Each case reports p50/p95 latency, the process' peak RSS after the case (this only
+ever goes up, so compare runs with the same cases in the same order), the peak
+memory traced by tracemalloc and the number of memory blocks the case left
+allocated. Pillow allocates image memory outside of Python's allocator, so image
+buffers only show up in the peak RSS.
+"""
+
+import argparse
+import json
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import PIL
+from PIL import ImageChops, ImageDraw, ImageStat
+
+from .scoreboards import BASE_DIR, FlagDraw, Position, ScoreboardMaker
+from .unicornia.images import ImageUtil, TextDraw
+
+HEADER_TEXT = "Hello, World!"
+# header lengths up to the 40 characters [p]judge allows
+HEADER_TEXTS = ["Hello", "Hello, World! Judge me", "x" * 40]
+OUTLINE_WIDTHS = [None, 2, 8, 16]
+ROTATIONS = [0, 5, 10, 45]
+SCORE_TEXT = "9.4"
+SCOREBOARD_IMAGE = "scoreboard_01.png"
+
+DEFAULT_ITERATIONS = 20
+DEFAULT_OUTPUT = "benchmark_results.json"
+
+
+@dataclass
+class BenchmarkResult:
+    """Timing and memory results for one benchmark case."""
+
+    name: str
+    params: Dict = field(default_factory=dict)
+    iterations: int = 0
+    p50_ms: float = 0.0
+    p95_ms: float = 0.0
+    mean_ms: float = 0.0
+    peak_rss_kb: int = 0
+    peak_traced_kb: float = 0.0
+    allocated_blocks: int = 0
+
+    @property
+    def key(self) -> str:
+        """Identifies the case across runs."""
+        params = ", ".join(f"{k}={v}" for k, v in self.params.items())
+        return f"{self.name}({params})"
+
+
+class LegacyOutlineTextDraw(TextDraw):
+    """TextDraw that outlines text by drawing it at every offset, like it used to."""
+
+    def draw_text(
+        self,
+        draw: ImageDraw.Draw,
+        text_centered,
+        text: str,
+        font,
+        color: str = "black",
+        outline: bool = False,
+        outline_color: str = None,
+        outline_width: Optional[int] = None,
+        outline_scalar: float = 0.02,
+    ) -> None:
+        if outline:
+            if not outline_color:
+                outline_color = self.get_contrast_color(color)
+            outline_width = self.get_outline_width(font, outline_width, outline_scalar)
+            self.draw_text_outline(
+                draw, text_centered, text, font, outline_color, outline_width
+            )
+        draw.text(text_centered, text, font=font, fill=color)
+
+
+class TextDrawCounter:
+    """Context manager that counts calls to ImageDraw.text."""
+
+    def __init__(self):
+        self.count = 0
+        self._original = None
+
+    def __enter__(self):
+        self._original = ImageDraw.ImageDraw.text
+        counter = self
+
+        def text(draw, *args, **kwargs):
+            counter.count += 1
+            return counter._original(draw, *args, **kwargs)
+
+        ImageDraw.ImageDraw.text = text
+        return self
+
+    def __exit__(self, *exc):
+        ImageDraw.ImageDraw.text = self._original
+
+
+def percentile(samples: List[float], percent: float) -> float:
+    """Returns the nearest-rank percentile of the samples."""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def get_peak_rss_kb() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports kilobytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_case(
+    name: str,
+    func: Callable,
+    setup: Optional[Callable] = None,
+    iterations: int = DEFAULT_ITERATIONS,
+    warmup: int = 1,
+    **params,
+) -> BenchmarkResult:
+    """Times func over a number of iterations.
+
+    Args:
+        name (str): Name of the case.
+        func (Callable): The code being measured. Called with the return value of
+            setup, if there is one.
+        setup (Optional[Callable]): Called before each iteration, outside of the timing.
+        iterations (int): Number of timed iterations.
+        warmup (int): Number of untimed iterations run first, to fill caches.
+        **params: Parameters of the case, stored with the results.
+
+    Returns:
+        BenchmarkResult: The results of the case.
+    """
+    args = ()
+    for _ in range(warmup):
+        args = (setup(),) if setup else ()
+        func(*args)
+
+    samples = []
+    tracemalloc.start()
+    blocks_before = sys.getallocatedblocks()
+    for _ in range(iterations):
+        args = (setup(),) if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        samples.append((time.perf_counter() - start) * 1000)
+    del args
+    allocated_blocks = sys.getallocatedblocks() - blocks_before
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return BenchmarkResult(
+        name=name,
+        params=params,
+        iterations=iterations,
+        p50_ms=percentile(samples, 50),
+        p95_ms=percentile(samples, 95),
+        mean_ms=sum(samples) / len(samples),
+        peak_rss_kb=get_peak_rss_kb(),
+        peak_traced_kb=peak_traced / 1024,
+        allocated_blocks=allocated_blocks,
+    )
+
+
+def run_benchmarks(iterations: int = DEFAULT_ITERATIONS) -> List[BenchmarkResult]:
+    """Runs every benchmark case against the bundled templates and flags."""
+    # keep the random scores, templates and flags the same between runs
+    random.seed(0)
+
+    maker = ScoreboardMaker()
+    flags_util = maker.flags_util
+    image_data = maker.images_data[SCOREBOARD_IMAGE]
+    base_image = maker.base_images[SCOREBOARD_IMAGE]
+    position = image_data.positions[0]
+    flag = flags_util.flags[0]
+    flag_image_path, flag_image = flag.path, flag.image
+
+    def new_text_draw():
+        return TextDraw(base_image.copy())
+
+    results = []
+
+    for output_format in ScoreboardMaker.ENCODER_OPTIONS:
+        for text in (None, HEADER_TEXT):
+            results.append(
+                run_case(
+                    "create_scoreboard",
+                    lambda: maker.create_scoreboard(text, output_format=output_format),
+                    iterations=iterations,
+                    output_format=output_format,
+                    text=text,
+                )
+            )
+
+    for text in HEADER_TEXTS:
+        for outline_width in OUTLINE_WIDTHS:
+            results.append(
+                run_case(
+                    "draw_header_text",
+                    lambda text_draw: text_draw.draw_header_text(
+                        text,
+                        color=image_data.color,
+                        outline=True,
+                        outline_width=outline_width,
+                    ),
+                    setup=new_text_draw,
+                    iterations=iterations,
+                    length=len(text),
+                    outline_width=outline_width,
+                )
+            )
+
+    for rotation in ROTATIONS:
+        results.append(
+            run_case(
+                "draw_text_on_image",
+                lambda text_draw: text_draw.draw_text_on_image(
+                    SCORE_TEXT,
+                    position=position,
+                    rotation=rotation,
+                    font_size=image_data.size,
+                    color=image_data.color,
+                ),
+                setup=new_text_draw,
+                iterations=iterations,
+                rotation=rotation,
+            )
+        )
+        results.append(
+            run_case(
+                "draw_glyphs_on_image",
+                lambda text_draw: text_draw.draw_glyphs_on_image(
+                    SCORE_TEXT,
+                    position=position,
+                    rotation=rotation,
+                    font_size=image_data.size,
+                    color=image_data.color,
+                ),
+                setup=new_text_draw,
+                iterations=iterations,
+                rotation=rotation,
+            )
+        )
+        results.append(
+            run_case(
+                "paste_centered",
+                lambda image: ImageUtil.paste_centered(
+                    image, flag_image, position, rotation
+                ),
+                setup=base_image.copy,
+                iterations=iterations,
+                rotation=rotation,
+            )
+        )
+
+    results.append(
+        run_case(
+            "overlay_flag",
+            lambda image: flags_util.overlay_flag(
+                image, flag_image_path, Position(position.x, 924)
+            ),
+            setup=base_image.copy,
+            iterations=iterations,
+            cached=True,
+        )
+    )
+    results.append(
+        run_case(
+            "overlay_flag",
+            lambda image: flags_util.overlay_flag(
+                image, flag_image_path, Position(position.x, 924), scale=0.5
+            ),
+            setup=base_image.copy,
+            iterations=iterations,
+            cached=False,
+        )
+    )
+
+    return results
+
+
+def draw_header(text_draw_class, base_image, text: str, color: str):
+    """Draws an outlined header and returns the image, time taken and text draws."""
+    text_draw = text_draw_class(base_image.copy())
+    with TextDrawCounter() as counter:
+        start = time.perf_counter()
+        text_draw.draw_header_text(text, color=color, outline=True)
+        elapsed = time.perf_counter() - start
+    return text_draw.image, elapsed, counter.count
+
+
+def bench_outline(text: str = HEADER_TEXT) -> List[Dict]:
+    """Compares multi-pass and stroked header outlines on every scoreboard template.
+
+    Returns:
+        List[Dict]: One result per template with timings, text draw counts and the
+        mean per-channel pixel difference between the two outputs (0-255).
+    """
+    maker = ScoreboardMaker()
+    results = []
+    for image_name, base_image in maker.base_images.items():
+        color = maker.images_data[image_name].color
+
+        legacy, legacy_time, legacy_draws = draw_header(
+            LegacyOutlineTextDraw, base_image, text, color
+        )
+        stroked, stroked_time, stroked_draws = draw_header(
+            TextDraw, base_image, text, color
+        )
+        diff = ImageStat.Stat(ImageChops.difference(legacy, stroked)).mean
+
+        results.append(
+            {
+                "image": image_name,
+                "legacy_ms": legacy_time * 1000,
+                "legacy_draws": legacy_draws,
+                "stroked_ms": stroked_time * 1000,
+                "stroked_draws": stroked_draws,
+                "mean_diff": sum(diff) / len(diff),
+            }
+        )
+    return results
+
+
+def get_commit() -> Optional[str]:
+    """Returns the git commit the cog is checked out at, if it's a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(
+    path: Path, results: List[BenchmarkResult], outline: List[Dict]
+) -> None:
+    data = {
+        "commit": get_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "platform": platform.platform(),
+        "results": [dict(asdict(result), key=result.key) for result in results],
+        "outline": outline,
+    }
+    path.write_text(json.dumps(data, indent=2))
+
+
+def compare_results(path: Path, results: List[BenchmarkResult]) -> None:
+    """Prints the change in p50 and p95 latency against a previous run."""
+    previous = json.loads(path.read_text())
+    previous_results = {result["key"]: result for result in previous["results"]}
+
+    print(f"\nCompared to {path} ({previous.get('commit') or 'unknown commit'}):")
+    for result in results:
+        before = previous_results.get(result.key)
+        if not before:
+            print(f"  {result.key}: new")
+            continue
+        p50_change = (result.p50_ms / before["p50_ms"] - 1) * 100
+        p95_change = (result.p95_ms / before["p95_ms"] - 1) * 100
+        print(f"  {result.key}: p50 {p50_change:+.1f}%  p95 {p95_change:+.1f}%")
+
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--output", type=Path, default=Path(DEFAULT_OUTPUT))
+    parser.add_argument("--compare", type=Path, help="results of a previous run")
+    args = parser.parse_args(args)
+
+    results = run_benchmarks(iterations=args.iterations)
+    for result in results:
+        print(
+            f"{result.key}: p50 {result.p50_ms:.2f}ms  p95 {result.p95_ms:.2f}ms  "
+            f"rss {result.peak_rss_kb}KB  traced {result.peak_traced_kb:.1f}KB  "
+            f"blocks {result.allocated_blocks}"
+        )
+
+    outline = bench_outline()
+    print(f'\nHeader outline ("{HEADER_TEXT}"):')
+    for result in outline:
+        print(
+            f"  {result['image']}: "
+            f"{result['legacy_draws']} draws {result['legacy_ms']:.1f}ms -> "
+            f"{result['stroked_draws']} draws {result['stroked_ms']:.1f}ms "
+            f"(mean pixel diff {result['mean_diff']:.2f})"
+        )
+
+    save_results(args.output, results, outline)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        compare_results(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
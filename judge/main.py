@@ -6,6 +6,7 @@ from redbot.core import commands
 from redbot.core.bot import Red
 
 from . import __author__, __version__
+from .render_pool import RenderQueueFull
 from .scoreboards import ScoreboardMaker
 from .unicornia import strings
 
@@ -13,7 +14,7 @@ from .unicornia import strings
 class JudgeCog(commands.Cog):
     EMBED_COLOR = discord.Color.from_str("#9401fe")
     EMBED_FOOTER = f"Judge Cog ({__version__}) - by: {__author__}"
-    TEMP_FILENAME = "judges_score.jpg"
+    OUTPUT_FILENAME = "judges_score"
     ALLOWED_ROLE_IDS = [
         700121551483437128,  # supporter role
         696020813299580940,  # staff role
@@ -32,6 +33,9 @@ class JudgeCog(commands.Cog):
 
         self.scoreboard_maker = ScoreboardMaker()
 
+    def cog_unload(self):
+        self.scoreboard_maker.close()
+
     @staticmethod
     def convert_mentions(text: str, member: discord.User):
         # matches @<[userID]>
@@ -69,18 +73,29 @@ class JudgeCog(commands.Cog):
 
         # Indicate that the bot is typing
         async with ctx.typing():
-            output_image_path = self.scoreboard_maker.create_scoreboard(
-                text=text, text_color=color
-            )
-
-            file = discord.File(fp=output_image_path, filename=self.TEMP_FILENAME)
+            # render in the pool so the bot isn't blocked while Pillow works
+            try:
+                output_image = await self.scoreboard_maker.render_async(
+                    text=text,
+                    text_color=color,
+                    guild_id=ctx.guild.id if ctx.guild else None,
+                )
+            except RenderQueueFull as e:
+                self.logger.debug(f"Scoreboard not queued: {e}")
+                self.reset_cooldown(ctx, "judge")
+                return await ctx.send(
+                    "The judges are busy with other scores right now. Try again in a bit."
+                )
+
+            filename = f"{self.OUTPUT_FILENAME}.{self.scoreboard_maker.file_extension}"
+            file = discord.File(fp=output_image, filename=filename)
 
             # Create the embed object
             embed = discord.Embed(color=self.EMBED_COLOR)
 
             footer = self.EMBED_FOOTER
             embed.set_footer(text=footer, icon_url=self.bot.user.avatar.url)
-            embed.set_image(url=f"attachment://{self.TEMP_FILENAME}")
+            embed.set_image(url=f"attachment://{filename}")
 
             return await ctx.send(embed=embed, file=file)
 
@@ -0,0 +1,180 @@
+"""Executor pool used to render scoreboards off of the event loop
+
+Jobs are queued per guild and handed to the executor round-robin, so one guild
+spamming `[p]judge` can't starve everyone else.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Hashable, Optional
+
+
+class RenderQueueFull(Exception):
+    """Raised when the render pool can't accept any more jobs."""
+
+
+class RenderPool:
+    """Runs a render function in a thread or process pool with bounded, fair queues.
+
+    Attributes:
+        func (Callable): The function that does the rendering. For process pools it
+            has to be a picklable, module-level function.
+        mode (str): "thread" or "process".
+        workers (int): Number of jobs rendered at the same time.
+        max_queue (int): Maximum number of queued and running jobs.
+        max_per_guild (int): Maximum number of queued and running jobs for a single guild.
+    """
+
+    THREAD = "thread"
+    PROCESS = "process"
+
+    def __init__(
+        self,
+        func: Callable,
+        mode: str = THREAD,
+        workers: int = 2,
+        max_queue: int = 16,
+        max_per_guild: int = 4,
+        initializer: Optional[Callable] = None,
+        initargs: tuple = (),
+    ):
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self.logger.setLevel(logging.INFO)
+
+        self.func = func
+        self.mode = mode
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_per_guild = max_per_guild
+
+        self.executor = self.create_executor(mode, workers, initializer, initargs)
+
+        # pending jobs for each guild. Guilds are served in the order of this dict
+        # and moved to the back after each job
+        self.queues: "OrderedDict[Hashable, deque]" = OrderedDict()
+        # number of queued and running jobs for each guild
+        self.guild_jobs: Dict[Hashable, int] = {}
+        self.queued = 0
+        self.running = 0
+
+    @classmethod
+    def create_executor(
+        cls,
+        mode: str,
+        workers: int,
+        initializer: Optional[Callable] = None,
+        initargs: tuple = (),
+    ) -> Executor:
+        if mode == cls.THREAD:
+            return ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix="scoreboard",
+                initializer=initializer,
+                initargs=initargs,
+            )
+        elif mode == cls.PROCESS:
+            # don't fork the bot process, it has a running event loop and threads
+            return ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=initializer,
+                initargs=initargs,
+            )
+        else:
+            raise ValueError(f'Unsupported render pool mode "{mode}"!')
+
+    @property
+    def pending(self) -> int:
+        """Number of queued and running jobs."""
+        return self.queued + self.running
+
+    async def submit(self, guild_id: Hashable, *args):
+        """Queue a render job and wait for its result.
+
+        Args:
+            guild_id (Hashable): Key used for fairness between guilds.
+            *args: Arguments passed on to the render function.
+
+        Raises:
+            RenderQueueFull: If the pool or the guild already has too many jobs.
+
+        Returns:
+            The return value of the render function.
+        """
+        if self.pending >= self.max_queue:
+            raise RenderQueueFull(f"{self.pending} scoreboards are already queued.")
+        if self.guild_jobs.get(guild_id, 0) >= self.max_per_guild:
+            raise RenderQueueFull(
+                f"Guild {guild_id} already has {self.max_per_guild} scoreboards queued."
+            )
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.queues.setdefault(guild_id, deque()).append((future, args))
+        self.guild_jobs[guild_id] = self.guild_jobs.get(guild_id, 0) + 1
+        self.queued += 1
+
+        self.dispatch(loop)
+        return await future
+
+    def dispatch(self, loop: asyncio.AbstractEventLoop):
+        """Hand queued jobs to the executor until all workers are busy."""
+        while self.running < self.workers and self.queues:
+            guild_id, queue = self.queues.popitem(last=False)
+            future, args = queue.popleft()
+            if queue:
+                # send the guild to the back of the line
+                self.queues[guild_id] = queue
+            self.queued -= 1
+
+            # the caller stopped waiting while the job was queued
+            if future.done():
+                self.release(guild_id)
+                continue
+
+            self.running += 1
+            job = loop.run_in_executor(self.executor, self.func, *args)
+            job.add_done_callback(partial(self.on_job_done, loop, guild_id, future))
+
+    def on_job_done(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        guild_id: Hashable,
+        future: asyncio.Future,
+        job: asyncio.Future,
+    ):
+        self.running -= 1
+        self.release(guild_id)
+
+        if not future.done():
+            if job.cancelled():
+                future.cancel()
+            elif job.exception() is not None:
+                future.set_exception(job.exception())
+            else:
+                future.set_result(job.result())
+
+        self.dispatch(loop)
+
+    def release(self, guild_id: Hashable):
+        count = self.guild_jobs.get(guild_id, 0) - 1
+        if count > 0:
+            self.guild_jobs[guild_id] = count
+        else:
+            self.guild_jobs.pop(guild_id, None)
+
+    def shutdown(self):
+        """Cancel queued jobs and stop the executor without waiting on running jobs."""
+        for queue in self.queues.values():
+            for future, _ in queue:
+                future.cancel()
+        self.queues.clear()
+        self.guild_jobs.clear()
+        self.queued = 0
+
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.logger.debug("Render pool shut down.")
@@ -1,20 +1,24 @@
+import io
+import json
 import logging
+import os
 import random
 import re
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote
 
 import yaml
 from PIL import Image
 from collections import namedtuple
 
+from .render_pool import RenderPool
 from .unicornia.images import ImageUtil, Position
 from .unicornia.images import TextDraw
 
-# Class constants for the output directory and config file path
+# Class constants for the images directory and config file path
 BASE_DIR = Path(__file__).resolve().parent
-OUTPUT_DIR = BASE_DIR / "output_images"
 IMAGES_DIR = BASE_DIR / "images"
 
 
@@ -52,47 +56,235 @@ class ScoreboardBaseImage:
         self.positions = [Position(x, y) for x, y in self.positions]
 
 
+@dataclass
+class Flag:
+    """
+    A flag from the flag index, ready to be pasted.
+
+    Attributes:
+    ----------
+    nation : str
+        The nation name parsed from the file name. e.g. "Austria (state)"
+    path : Path
+        The file path to the flag image.
+    size : Tuple[int, int]
+        The size of the resized and outlined flag image.
+    image : Image.Image
+        The resized and outlined flag image.
+    """
+
+    nation: str
+    path: Path
+    size: Tuple[int, int]
+    image: Optional[Image.Image] = field(default=None, repr=False)
+
+    @property
+    def nation_key(self) -> str:
+        """The nation name without any qualifier, used to avoid duplicate nations."""
+        return self.nation.split(" (")[0]
+
+
 class FlagDraw(ImageUtil):
-    """Utility class for drawing flag images on images using Pillow."""
+    """Utility class for drawing flag images on images using Pillow.
+
+    Flags are kept in an index with their nation names and resized, outlined pixel
+    data. The index is saved to a manifest and a pixel file in CACHE_DIR, so later
+    loads skip decoding the PNGs. The flag folder is scanned once per load, and the
+    manifest is rebuilt when a flag is added, removed, renamed or replaced (each file's
+    modification time and size are part of its key), when the flag scale changes, or
+    when it can't be read.
+    """
 
     FLAG_PATH = IMAGES_DIR / "flag"
     OUTPUT_PATH = BASE_DIR / "output_images" / "flag_test.png"
+    CACHE_DIR = BASE_DIR / "cache"
+    MANIFEST_PATH = CACHE_DIR / "flags.json"
+    PIXELS_PATH = CACHE_DIR / "flags.rgba"
+    MANIFEST_VERSION = 3
+    # scale the cached flag images are prepared at
+    FLAG_SCALE = 1.0
 
     def __init__(self):
         self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
         self.logger.setLevel(logging.INFO)
-        self.flags = self.get_all_flags()
+
+        self.flags: List[Flag] = self.load_index()
+        self.flags_by_path: Dict[Path, Flag] = {flag.path: flag for flag in self.flags}
+        # flags grouped by nation, so a random pick per group gives distinct nations
+        nations: Dict[str, List[Flag]] = {}
+        for flag in self.flags:
+            nations.setdefault(flag.nation_key, []).append(flag)
+        self.nations: List[List[Flag]] = list(nations.values())
 
     @classmethod
     def get_all_flags(cls):
         """Get a list of all flag images from the flag path."""
         return [f for f in cls.FLAG_PATH.iterdir() if f.is_file()]
 
-    def get_random_flag(self):
-        """Get a random flag image from the flag path and extract the nation name."""
-        random_flag = random.choice(self.flags)
-        match = re.search(r"Flag_of_(.*)\.svg\.png", random_flag.name)
-        nation_name = match.group(1).replace("_", " ") if match else "Unknown"
-        return nation_name, random_flag
+    @staticmethod
+    def get_nation_name(flag_image_path: Path) -> str:
+        """Extract the nation name from a flag image file name."""
+        match = re.search(r"Flag_of_(.*)\.svg\.png", unquote(flag_image_path.name))
+        return match.group(1).replace("_", " ") if match else "Unknown"
 
     @classmethod
+    def prepare_flag(cls, flag_image_path: Path, scale: float = 1.0) -> Image.Image:
+        """Open, resize and outline a flag image so it's ready to be pasted."""
+        flag_image = cls.load_image(flag_image_path)
+
+        # Resize the flag image to fit the base image while keeping the aspect ratio
+        flag_image = cls.resize_image(flag_image, scale)
+
+        return cls.draw_image_outline(flag_image)
+
+    def load_index(self) -> List[Flag]:
+        """Load the flag index from the manifest, rebuilding it if it's out of date."""
+        flag_files = self.scan_flags()
+        key = self.get_manifest_key(flag_files)
+        flags = self.load_manifest(key)
+        if flags is None:
+            flags = self.build_index(flag_files)
+            self.save_manifest(flags, key)
+        self.logger.debug(f"Loaded {len(flags)} flags.")
+        return flags
+
+    def build_index(self, flag_files: Dict[Path, Tuple[int, int]]) -> List[Flag]:
+        """Decode and outline every flag image so renders only need to paste."""
+        flags = []
+        for flag_image_path in flag_files:
+            try:
+                flag_image = self.prepare_flag(flag_image_path, self.FLAG_SCALE)
+            except OSError as e:
+                self.logger.error(f"Unable to load flag {flag_image_path.name}: {e}")
+                continue
+
+            flags.append(
+                Flag(
+                    nation=self.get_nation_name(flag_image_path),
+                    path=flag_image_path,
+                    size=flag_image.size,
+                    image=flag_image,
+                )
+            )
+        return flags
+
+    @classmethod
+    def scan_flags(cls) -> Dict[Path, Tuple[int, int]]:
+        """Get the modification time and size of every flag image, sorted by path."""
+        flag_files = {}
+        with os.scandir(cls.FLAG_PATH) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    flag_files[Path(entry.path)] = (stat.st_mtime_ns, stat.st_size)
+        return dict(sorted(flag_files.items()))
+
+    @classmethod
+    def get_manifest_key(cls, flag_files: Dict[Path, Tuple[int, int]]) -> dict:
+        """Values the manifest has to match to still be valid."""
+        return {
+            "version": cls.MANIFEST_VERSION,
+            "scale": cls.FLAG_SCALE,
+            # a flag replaced in place doesn't change the folder's modification time
+            "files": {path.name: list(key) for path, key in flag_files.items()},
+        }
+
+    def load_manifest(self, key: dict) -> Optional[List[Flag]]:
+        """Load the flag index from the manifest. Returns None if it's missing or stale."""
+        try:
+            manifest = json.loads(self.MANIFEST_PATH.read_text())
+            if manifest.get("key") != key:
+                self.logger.info("Flag manifest is out of date, rebuilding it.")
+                return None
+            # slices of the memoryview share the file's buffer
+            pixels = memoryview(self.PIXELS_PATH.read_bytes())
+        except (OSError, ValueError, AttributeError):
+            return None
+
+        flags = []
+        try:
+            for entry in manifest["flags"]:
+                offset, length = entry["offset"], entry["length"]
+                size = tuple(entry["size"])
+                if offset < 0 or offset + length > len(pixels):
+                    raise ValueError(f"{entry['file']} is outside the pixel file.")
+                image = Image.frombuffer(
+                    "RGBA", size, pixels[offset : offset + length], "raw", "RGBA", 0, 1
+                )
+                flags.append(
+                    Flag(
+                        nation=entry["nation"],
+                        path=self.FLAG_PATH / entry["file"],
+                        size=size,
+                        image=image,
+                    )
+                )
+        except (KeyError, TypeError, ValueError) as e:
+            self.logger.warning(f"Flag manifest is invalid, rebuilding it: {e!r}")
+            return None
+        return flags
+
+    def save_manifest(self, flags: List[Flag], key: dict):
+        """Save the flag index so the next load doesn't need to decode any flags."""
+        entries = []
+        offset = 0
+        try:
+            self.CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            temp_pixels_path = self.PIXELS_PATH.with_suffix(".tmp")
+            with open(temp_pixels_path, "wb") as file:
+                for flag in flags:
+                    data = flag.image.tobytes()
+                    file.write(data)
+                    entries.append(
+                        {
+                            "nation": flag.nation,
+                            "file": flag.path.name,
+                            "size": list(flag.size),
+                            "offset": offset,
+                            "length": len(data),
+                        }
+                    )
+                    offset += len(data)
+            temp_pixels_path.replace(self.PIXELS_PATH)
+
+            manifest = {"key": key, "flags": entries}
+            temp_manifest_path = self.MANIFEST_PATH.with_suffix(".tmp")
+            temp_manifest_path.write_text(json.dumps(manifest))
+            temp_manifest_path.replace(self.MANIFEST_PATH)
+        except OSError as e:
+            self.logger.warning(f"Unable to save the flag manifest: {e}")
+
+    def get_random_flag(self):
+        """Get a random flag image from the flag path and its nation name."""
+        flag = random.choice(self.flags)
+        return flag.nation, flag.path
+
+    def get_random_flags(self, count: int) -> List[Flag]:
+        """Get random flags, each from a different nation."""
+        return [random.choice(nation) for nation in random.sample(self.nations, count)]
+
+    def paste_flag(self, base_image, flag: Flag, position=(0, 0)):
+        """Paste a flag from the index centered on the position."""
+        # the flag image is only pasted from, never modified, so it isn't copied
+        self.paste_centered(base_image, flag.image, position, rotation=0)
+        return base_image
+
     def overlay_flag(
-        cls,
+        self,
         base_image,
         flag_image_path,
         position=(0, 0),
         scale=1.0,
     ):
-        # Open the flag image
-        flag_image = Image.open(flag_image_path).convert("RGBA")
-
-        # Resize the flag image to fit the base image while keeping the aspect ratio
-        flag_image = cls.resize_image(flag_image, scale)
-
-        flag_image = cls.draw_image_outline(flag_image)
+        # Use the indexed flag when possible
+        flag = self.flags_by_path.get(Path(flag_image_path))
+        if flag is None or scale != self.FLAG_SCALE:
+            flag_image = self.prepare_flag(flag_image_path, scale)
+        else:
+            flag_image = flag.image
 
         # Paste the flag image onto the base image at the specified position
-        cls.paste_centered(base_image, flag_image, position, rotation=0)
+        self.paste_centered(base_image, flag_image, position, rotation=0)
 
         return base_image
 
@@ -102,16 +294,53 @@ class ScoreboardMaker:
 
     IMAGES_DATA = IMAGES_DIR / "images.yaml"
 
-    def __init__(self, logger=None):
+    # Settings for rendering off the event loop. "process" mode renders in separate
+    # processes that each load their own copy of the images
+    RENDER_MODE = RenderPool.THREAD
+    RENDER_WORKERS = 2
+    # maximum number of scoreboards queued or rendering at once, in total and per guild
+    RENDER_MAX_QUEUE = 16
+    RENDER_MAX_PER_GUILD = 4
+
+    # Encoder used for the finished scoreboard: "png", "jpeg" or "webp"
+    OUTPUT_FORMAT = "jpeg"
+    ENCODER_OPTIONS = {
+        # lower compress levels are much faster and only slightly larger
+        "png": {"compress_level": 3},
+        "jpeg": {"quality": 85, "optimize": True},
+        "webp": {"quality": 85, "method": 4},
+    }
+    FILE_EXTENSIONS = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+
+    def __init__(
+        self,
+        logger=None,
+        render_mode: Optional[str] = None,
+        render_workers: Optional[int] = None,
+        output_format: Optional[str] = None,
+    ):
         self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
         self.logger.setLevel(logging.INFO)
 
+        self.output_format = output_format or self.OUTPUT_FORMAT
+        if self.output_format not in self.ENCODER_OPTIONS:
+            raise ValueError(f'Unsupported output format "{self.output_format}"!')
+
+        self.render_mode = render_mode or self.RENDER_MODE
+        self.render_workers = render_workers or self.RENDER_WORKERS
+        # created on first use so worker processes don't create pools of their own
+        self._render_pool = None
+
         self.images_data = self.load_scoreboard_images_data()
+        self.base_images = self.load_base_images()
+        self.load_score_glyphs()
 
         self.flags_util = FlagDraw()
 
-        # Ensure the output directory exists
-        OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    @property
+    def file_extension(self) -> str:
+        """File extension matching the output format."""
+        return self.FILE_EXTENSIONS[self.output_format]
 
     @staticmethod
     def get_random_score(alpha: int = 12, beta: int = 1):
@@ -169,24 +398,59 @@ class ScoreboardMaker:
 
         return config
 
-    def create_scoreboard(self, text: Optional[str] = None, text_color=None):
+    def load_base_images(self) -> Dict[str, Image.Image]:
+        """Decode every scoreboard base image once so renders can copy from memory."""
+        base_images = {}
+        for image_name, image_data in self.images_data.items():
+            base_images[image_name] = ImageUtil.load_image(image_data.image_filepath)
+
+        self.logger.debug(f"Cached {len(base_images)} scoreboard base images.")
+        return base_images
+
+    def load_score_glyphs(self):
+        """Pre-render the score glyphs for every size, color and rotation in use."""
+        atlas = TextDraw.get_glyph_atlas()
+        for image_data in self.images_data.values():
+            for rotation in set(image_data.rotations):
+                atlas.add(image_data.size, image_data.color, rotation)
+
+        self.logger.debug(f"Cached {len(atlas.glyphs)} sets of score glyphs.")
+
+    @classmethod
+    def encode_image(cls, image: Image.Image, output_format: str) -> io.BytesIO:
+        """Encodes an image into an in-memory buffer, rewound and ready to be read."""
+        # JPEG doesn't support transparency
+        if output_format == "jpeg" and image.mode != "RGB":
+            image = image.convert("RGB")
+
+        buffer = io.BytesIO()
+        image.save(buffer, format=output_format, **cls.ENCODER_OPTIONS[output_format])
+        buffer.seek(0)
+        return buffer
+
+    def create_scoreboard(
+        self,
+        text: Optional[str] = None,
+        text_color=None,
+        output_format: Optional[str] = None,
+    ) -> io.BytesIO:
         """
         Creates a scoreboard image with random scores and optional header text.
 
         Args:
             text (Optional[str]): The header text to be drawn on the image. Defaults to None.
             text_color: The color of the header text. If not provided, the default color from image data will be used.
+            output_format (Optional[str]): Encoder to use. Defaults to the maker's output format.
 
         Returns:
-            str: The file path of the saved scoreboard image.
+            io.BytesIO: The encoded scoreboard image.
         """
         image_name = random.choice(list(self.images_data.keys()))
 
         image_data = self.images_data[image_name]
-        base_image_path = image_data.image_filepath
 
-        # Open the base image
-        text_draw = TextDraw(base_image_path)
+        # Draw on a copy of the cached base image
+        text_draw = TextDraw(self.base_images[image_name].copy())
 
         # Draw the header text on the image if supplied
         if text:
@@ -205,33 +469,92 @@ class ScoreboardMaker:
         else:
             scores = [self.get_random_score() for _ in range(num_needed)]
 
+        # a random flag from a different nation for each scoreboard
+        flags = self.flags_util.get_random_flags(num_needed)
+
         # Draw each score on the image at the specified positions with the given rotation
-        for position, rotation, score in zip(
-            image_data.positions, image_data.rotations, scores
+        for position, rotation, score, flag in zip(
+            image_data.positions, image_data.rotations, scores, flags
         ):
-            text_draw.draw_text_on_image(
+            text_draw.draw_glyphs_on_image(
                 str(score),
                 position=position,
                 rotation=rotation,
                 font_size=image_data.size,
                 color=image_data.color,
-                outline=False,
             )
 
             # draw a random flag aligned vertically with each scoreboard
-            nation, flag_image_path = self.flags_util.get_random_flag()
             flag_x, flag_y = position
             flag_y = (
                 text_draw.image.size[1] - 100
             )  # align the flag 100 pixels from the bottom of the image
-            self.flags_util.overlay_flag(
-                text_draw.image, flag_image_path, (flag_x, flag_y), scale=1.0
-            )
+            self.flags_util.paste_flag(text_draw.image, flag, (flag_x, flag_y))
 
         final_image = text_draw.image
 
-        # Create the output path dynamically
-        output_image_path = OUTPUT_DIR / f"judges_scores.png"
-        final_image.save(output_image_path)
-        # final_image.show()
-        return output_image_path
+        # encode in memory, so concurrent renders never share a file
+        return self.encode_image(final_image, output_format or self.output_format)
+
+    @property
+    def render_pool(self) -> RenderPool:
+        if self._render_pool is None:
+            if self.render_mode == RenderPool.PROCESS:
+                func, initializer = render_in_worker, init_render_worker
+            else:
+                func, initializer = self.create_scoreboard, None
+
+            self._render_pool = RenderPool(
+                func,
+                mode=self.render_mode,
+                workers=self.render_workers,
+                max_queue=self.RENDER_MAX_QUEUE,
+                max_per_guild=self.RENDER_MAX_PER_GUILD,
+                initializer=initializer,
+            )
+        return self._render_pool
+
+    async def render_async(
+        self, text: Optional[str] = None, text_color=None, guild_id: int = None
+    ):
+        """
+        Creates a scoreboard image in the render pool without blocking the event loop.
+
+        Args:
+            text (Optional[str]): The header text to be drawn on the image. Defaults to None.
+            text_color: The color of the header text. If not provided, the default color from image data will be used.
+            guild_id (int): The guild the scoreboard is for. Used to keep the queue fair between guilds.
+
+        Raises:
+            RenderQueueFull: If too many scoreboards are already queued.
+
+        Returns:
+            Same as create_scoreboard().
+        """
+        return await self.render_pool.submit(
+            guild_id, text, text_color, self.output_format
+        )
+
+    def close(self):
+        """Shuts down the render pool."""
+        if self._render_pool is not None:
+            self._render_pool.shutdown()
+            self._render_pool = None
+
+
+# ScoreboardMaker used by each worker process when rendering in "process" mode
+_worker_maker: Optional[ScoreboardMaker] = None
+
+
+def init_render_worker():
+    """Loads the scoreboard images once for each worker process."""
+    global _worker_maker
+    _worker_maker = ScoreboardMaker()
+
+
+def render_in_worker(
+    text: Optional[str] = None, text_color=None, output_format: Optional[str] = None
+):
+    return _worker_maker.create_scoreboard(
+        text=text, text_color=text_color, output_format=output_format
+    )
@@ -42,7 +42,10 @@ class ImageUtil:
 
     @classmethod
     def paste_centered(cls, base_image, overlay_image, position, rotation):
-        rotated_image = cls.rotate_image(overlay_image, rotation)
+        # rotating by 0 would still make a copy of the image
+        rotated_image = (
+            cls.rotate_image(overlay_image, rotation) if rotation else overlay_image
+        )
         rotated_width, rotated_height = rotated_image.size
         # Calculate top-left corner for centering the rotated text image
         top_left_x = position[0] - rotated_width // 2
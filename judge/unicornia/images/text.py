@@ -1,12 +1,167 @@
+import math
 from collections import namedtuple
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional, Tuple, Union
 
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageColor, ImageDraw, ImageFont
 
 from .images import ImageUtil, Position
 
-__all__ = ["TextDraw"]
+__all__ = ["TextDraw", "GlyphAtlas", "get_font", "get_text_length"]
+
+# font size glyph metrics are measured at. Text width scales linearly with the font
+# size, so widths at other sizes are calculated from these
+METRICS_FONT_SIZE = 100
+
+
+@lru_cache(maxsize=64)
+def get_font(font_path: Union[str, Path], font_size: int) -> ImageFont.FreeTypeFont:
+    """Loads a TrueType font, keeping it cached for the life of the process."""
+    return ImageFont.truetype(str(font_path), font_size)
+
+
+@lru_cache(maxsize=4096)
+def get_glyph_length(font_path: Union[str, Path], character: str) -> float:
+    """Returns the advance width of a single character at METRICS_FONT_SIZE."""
+    return get_font(font_path, METRICS_FONT_SIZE).getlength(character)
+
+
+def get_text_length(font_path: Union[str, Path], text: str) -> float:
+    """Returns the width of the text at METRICS_FONT_SIZE using cached glyph metrics."""
+    return sum(get_glyph_length(font_path, character) for character in text)
+
+
+@dataclass
+class Glyph:
+    """A pre-rendered, rotated character from a GlyphAtlas.
+
+    Attributes:
+        image (Image.Image): The rendered and rotated character.
+        center (Tuple[float, float]): Center of the unrotated image, relative to the
+            position the character would be drawn at.
+        bbox (Tuple[int, int, int, int]): Bounding box of the character relative to
+            the position it would be drawn at.
+        advance (float): Distance to the next character.
+    """
+
+    image: Image.Image
+    center: Tuple[float, float]
+    bbox: Tuple[int, int, int, int]
+    advance: float
+
+
+class GlyphAtlas:
+    """Characters pre-rendered for each (font size, color, rotation).
+
+    Drawing a string from the atlas only pastes already rendered glyphs, so FreeType
+    and rotation are kept out of the per-image work. Meant for short strings made
+    from a small set of characters, like scores.
+    """
+
+    CHARACTERS = "0123456789."
+    # transparent space around each glyph so rotation doesn't clip anti-aliasing
+    PADDING = 2
+
+    def __init__(self, font_path: Union[str, Path], characters: str = CHARACTERS):
+        self.font_path = font_path
+        self.characters = characters
+        self.glyphs: Dict[tuple, Dict[str, Glyph]] = {}
+
+    @staticmethod
+    def get_key(font_size: int, color, rotation: int) -> tuple:
+        if isinstance(color, str):
+            color = ImageColor.getrgb(color)
+        return (font_size, tuple(color), rotation)
+
+    def supports(self, text: str) -> bool:
+        """Returns True if every character of the text is in the atlas."""
+        return all(character in self.characters for character in text)
+
+    def render_glyph(
+        self, font: ImageFont.FreeTypeFont, character: str, color, rotation: int
+    ) -> Glyph:
+        left, top, right, bottom = font.getbbox(character)
+        size = (right - left + 2 * self.PADDING, bottom - top + 2 * self.PADDING)
+        glyph_image = Image.new("RGBA", size, (255, 255, 255, 0))
+        draw = ImageDraw.Draw(glyph_image)
+        draw.text(
+            (self.PADDING - left, self.PADDING - top), character, font=font, fill=color
+        )
+        center = (left - self.PADDING + size[0] / 2, top - self.PADDING + size[1] / 2)
+
+        # rotating around the center keeps the character's center in the middle
+        if rotation:
+            glyph_image = glyph_image.rotate(
+                rotation, expand=True, resample=Image.BICUBIC
+            )
+
+        return Glyph(
+            image=glyph_image,
+            center=center,
+            bbox=(left, top, right, bottom),
+            advance=font.getlength(character),
+        )
+
+    def add(self, font_size: int, color, rotation: int = 0) -> Dict[str, Glyph]:
+        """Renders every character for the font size, color and rotation."""
+        key = self.get_key(font_size, color, rotation)
+        glyphs = self.glyphs.get(key)
+        if glyphs is None:
+            font = get_font(self.font_path, font_size)
+            glyphs = {
+                character: self.render_glyph(font, character, color, rotation)
+                for character in self.characters
+            }
+            self.glyphs[key] = glyphs
+        return glyphs
+
+    def draw(
+        self,
+        image: Image.Image,
+        text: str,
+        position: Position,
+        font_size: int,
+        color,
+        rotation: int = 0,
+    ) -> Image.Image:
+        """Pastes the text centered on the position, rotated around its center.
+
+        The text is laid out the same way as TextDraw.draw_text_on_image().
+        """
+        glyphs = self.add(font_size, color, rotation)
+        if not text:
+            return image
+
+        # lay out the characters and get the bounding box of the whole text
+        pen_x = 0.0
+        layout = []
+        top = bottom = None
+        for character in text:
+            glyph = glyphs[character]
+            layout.append((pen_x, glyph))
+            top = glyph.bbox[1] if top is None else min(top, glyph.bbox[1])
+            bottom = glyph.bbox[3] if bottom is None else max(bottom, glyph.bbox[3])
+            pen_x += glyph.advance
+        left = layout[0][1].bbox[0]
+        right = layout[-1][0] + layout[-1][1].bbox[2]
+        text_center = ((right - left) // 2, (bottom - top) // 2)
+
+        angle = math.radians(rotation)
+        cos, sin = math.cos(angle), math.sin(angle)
+        for pen_x, glyph in layout:
+            # offset of the glyph from the text center, rotated with the text
+            dx = pen_x + glyph.center[0] - text_center[0]
+            dy = glyph.center[1] - text_center[1]
+            x = position[0] + dx * cos + dy * sin
+            y = position[1] - dx * sin + dy * cos
+
+            width, height = glyph.image.size
+            offset = (round(x - width / 2), round(y - height / 2))
+            image.paste(glyph.image, offset, glyph.image)
+
+        return image
 
 
 class TextDraw(ImageUtil):
@@ -17,11 +172,22 @@ class TextDraw(ImageUtil):
     TEXT_FONT = FONTS_PATH / "calibrib.ttf"
     EMOJI_FONT = FONTS_PATH / "NotoColorEmoji-Regular.ttf"
 
-    def __init__(self, base_image_path: str):
+    # glyph atlases for each font path, see draw_glyphs_on_image()
+    glyph_atlases: Dict[Union[str, Path], GlyphAtlas] = {}
+
+    def __init__(self, base_image: Union[str, Path, Image.Image]):
+        """Draws on the given image, or on the image loaded from the given path.
+
+        An Image passed in directly is drawn on in place, so pass a copy if the
+        original needs to be reused.
+        """
         super().__init__()
 
         self.font_path = self.TEXT_FONT
-        self.image = self.load_image(base_image_path)
+        if isinstance(base_image, Image.Image):
+            self.image = base_image
+        else:
+            self.image = self.load_image(base_image)
         self.font = self.load_font()
 
     @staticmethod
@@ -48,7 +214,11 @@ class TextDraw(ImageUtil):
         outline_color: str,
         outline_width: int,
     ) -> None:
-        """Draws an outline around the text."""
+        """Draws an outline around the text by drawing it at every offset.
+
+        This costs (2 * outline_width + 1)^2 - 1 text draws. draw_text() uses Pillow's
+        stroke instead, which outlines in a single pass.
+        """
         for dx in range(-outline_width, outline_width + 1):
             for dy in range(-outline_width, outline_width + 1):
                 if dx != 0 or dy != 0:
@@ -60,15 +230,43 @@ class TextDraw(ImageUtil):
                     )
 
     @staticmethod
-    def create_text_image(base_image: Image.Image) -> Image.Image:
+    def create_text_image(size: Tuple[int, int]) -> Image.Image:
         """Creates a transparent image for drawing text."""
-        max_dimension = max(base_image.width, base_image.height)
-        return Image.new("RGBA", (max_dimension, max_dimension), (255, 255, 255, 0))
+        return Image.new("RGBA", size, (255, 255, 255, 0))
+
+    @staticmethod
+    def calculate_text_image_size(
+        text: str, font: ImageFont.FreeTypeFont, margin: int = 0
+    ) -> Tuple[Tuple[int, int], Position]:
+        """Calculates the smallest text image that fits the text plus a margin.
+
+        The text is centered the same way as calculate_text_position() does, and the
+        image is sized so that point lands on the image's center. Rotating the image
+        then rotates the text around its center.
+
+        Returns:
+            Tuple[Tuple[int, int], Position]: The image size and its center.
+        """
+        left, top, right, bottom = font.getbbox(text)
+        center_x = (right - left) // 2
+        center_y = (bottom - top) // 2
+        half_width = max(center_x - left, right - center_x) + margin
+        half_height = max(center_y - top, bottom - center_y) + margin
+        return (2 * half_width, 2 * half_height), Position(half_width, half_height)
+
+    @staticmethod
+    def get_outline_width(
+        font: ImageFont.FreeTypeFont,
+        outline_width: Optional[int] = None,
+        outline_scalar: float = 0.02,
+    ) -> int:
+        """Returns the outline width, scaling it with the font size if not given."""
+        return outline_width or max(4, int(font.size * outline_scalar))
 
     def load_font(self, font_size: int = 100) -> ImageFont.FreeTypeFont:
         """Loads the font from the given path or returns the default font."""
         return (
-            ImageFont.truetype(self.font_path, font_size)
+            get_font(self.font_path, font_size)
             if self.font_path
             else ImageFont.load_default()
         )
@@ -104,11 +302,18 @@ class TextDraw(ImageUtil):
         if outline:
             if not outline_color:
                 outline_color = self.get_contrast_color(color)
-            outline_width = outline_width or max(4, int(font.size * outline_scalar))
-            self.draw_text_outline(
-                draw, text_centered, text, font, outline_color, outline_width
+            outline_width = self.get_outline_width(font, outline_width, outline_scalar)
+            # the stroke is rasterized together with the text in one draw
+            draw.text(
+                text_centered,
+                text,
+                font=font,
+                fill=color,
+                stroke_width=outline_width,
+                stroke_fill=outline_color,
             )
-        draw.text(text_centered, text, font=font, fill=color)
+        else:
+            draw.text(text_centered, text, font=font, fill=color)
 
     @staticmethod
     def rotate_text_image(
@@ -131,13 +336,8 @@ class TextDraw(ImageUtil):
 
     def calculate_font_size(self, text: str) -> int:
         """Calculates the font size to fit the text within the image width."""
-        draw = ImageDraw.Draw(self.image)
-        initial_font_size = 10
-        font = ImageFont.truetype(self.font_path, initial_font_size)
-
-        # Calculate the bounding box of the text with the initial font size
-        text_bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = text_bbox[2] - text_bbox[0]
+        # Width of the text at METRICS_FONT_SIZE, from cached glyph metrics
+        text_width = max(1, get_text_length(self.font_path, text))
 
         # Calculate the margin and the available width for the text
         margin = max(2, self.image.width // 10)
@@ -147,7 +347,7 @@ class TextDraw(ImageUtil):
         scale_factor = available_width / text_width
 
         # Return the scaled font size
-        return int(initial_font_size * scale_factor)
+        return int(METRICS_FONT_SIZE * scale_factor)
 
     def draw_header_text(
         self,
@@ -202,11 +402,21 @@ class TextDraw(ImageUtil):
         outline_scalar: float = 0.02,
     ) -> Image.Image:
         """Draws text on the image with the specified parameters."""
-        image_center = Position(self.image.width // 2, self.image.height // 2)
-        text_image = self.create_text_image(self.image)
         font = self.load_font(font_size)
+        # leave room for the outline and a pixel of anti-aliasing around the text
+        margin = 1
+        if outline:
+            margin += self.get_outline_width(font, outline_width, outline_scalar)
+
+        # only allocate, rotate and paste an image the size of the text
+        text_size, text_image_center = self.calculate_text_image_size(
+            text, font, margin
+        )
+        text_image = self.create_text_image(text_size)
         draw = ImageDraw.Draw(text_image)
-        text_centered = self.calculate_text_position(draw, text, font, image_center)
+        text_centered = self.calculate_text_position(
+            draw, text, font, text_image_center
+        )
         self.draw_text(
             draw,
             text_centered,
@@ -222,3 +432,36 @@ class TextDraw(ImageUtil):
         offset = self.calculate_offset(position, text_image.size)
         self.image.paste(text_image, offset, text_image)
         return self.image
+
+    @classmethod
+    def get_glyph_atlas(cls, font_path: Union[str, Path] = None) -> GlyphAtlas:
+        """Returns the glyph atlas shared by everything drawing with the font."""
+        font_path = font_path or cls.TEXT_FONT
+        atlas = cls.glyph_atlases.get(font_path)
+        if atlas is None:
+            atlas = cls.glyph_atlases[font_path] = GlyphAtlas(font_path)
+        return atlas
+
+    def draw_glyphs_on_image(
+        self,
+        text: str,
+        position: Position = Position(0, 0),
+        rotation: int = 0,
+        font_size: int = 100,
+        color: str = "black",
+    ) -> Image.Image:
+        """Draws text using pre-rendered glyphs from the glyph atlas.
+
+        Falls back to draw_text_on_image() for text the atlas doesn't cover.
+        """
+        atlas = self.get_glyph_atlas(self.font_path) if self.font_path else None
+        if atlas is None or not atlas.supports(text):
+            return self.draw_text_on_image(
+                text,
+                position=position,
+                rotation=rotation,
+                font_size=font_size,
+                color=color,
+            )
+
+        return atlas.draw(self.image, text, position, font_size, color, rotation)
@@ -12,7 +12,7 @@ from . import __version__
 from .actions import Actions
 from .config import ConfigManager
 from .gifts import Gifts
-from .unicornia.predicates import ExtendedMessagePredicate
+from .unicornia.consent import ConsentDispatcher
 from .marriage_user import MarriageUser
 
 
@@ -33,11 +33,15 @@ class Marriage(commands.Cog):
         self.config_manager = ConfigManager(bot=self.bot, parent=self)
         self.actions = Actions(bot=self.bot, parent=self)
         self.gifts = Gifts(bot=self.bot, parent=self)
+        self.consent_dispatcher = ConsentDispatcher(bot)
 
         self.logger.info("-" * 32)
         self.logger.info(f"{self.__class__.__name__} v({__version__}) initialized!")
         self.logger.info("-" * 32)
 
+    async def cog_unload(self):
+        self.consent_dispatcher.stop()
+
     @staticmethod
     def format_help_for_context(ctx: commands.Context) -> str:
         context = super().format_help_for_context(ctx)
@@ -311,15 +315,16 @@ class Marriage(commands.Cog):
             f"{ctx.author.display_name} has asked {target_user.display_name} to marry them!\n"
             f"{target_user.mention}, what do you say?"
         )
-        pred = ExtendedMessagePredicate.yes_or_no(ctx, ctx.channel, target_user)
         try:
-            await self.bot.wait_for("message", timeout=self.CONSENT_TIMEOUT, check=pred)
+            accepted = await self.consent_dispatcher.wait_for_answer(
+                ctx.channel, target_user, timeout=self.CONSENT_TIMEOUT
+            )
         except asyncio.TimeoutError:
             return await ctx.send(
                 f"{target_user.display_name} took too long to respond. Try again later."
             )
 
-        if not pred.result:
+        if not accepted:
             return await ctx.send("Oh no... I was looking forward to the ceremony...")
 
         await author_user.marry(target_user)
@@ -404,16 +409,15 @@ class Marriage(commands.Cog):
                     author=ctx.author.display_name, target=target_user.mention
                 )
             )
-            pred = ExtendedMessagePredicate.yes_or_no(ctx, ctx.channel, target_user)
             try:
-                await self.bot.wait_for(
-                    "message", timeout=self.CONSENT_TIMEOUT, check=pred
+                accepted = await self.consent_dispatcher.wait_for_answer(
+                    ctx.channel, target_user, timeout=self.CONSENT_TIMEOUT
                 )
             except asyncio.TimeoutError:
                 return await ctx.send(
                     f"{target_user.display_name} took to long to respond. Try again later, please. (You didn't lose any contentment.)"
                 )
-            if not pred.result:
+            if not accepted:
                 await author_user.change_contentment(contentment * -1)
                 return await ctx.send(
                     f"{target_user.display_name} does not wish to do that."
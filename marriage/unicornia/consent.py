@@ -0,0 +1,112 @@
+"""Routes yes/no answers to the commands waiting for them
+
+Instead of every pending consent registering its own ``bot.wait_for`` check, which
+evaluates each incoming message against every pending predicate, one listener looks
+up the waiters for the message's channel and author and answers the oldest one.
+"""
+
+import asyncio
+from collections import defaultdict, deque
+from typing import Deque, Dict, Optional, Tuple
+
+import discord
+from redbot.core import commands
+
+from .predicates import ExtendedMessagePredicate
+
+
+class ConsentDispatcher:
+    """Waits for yes or no answers from members, keyed by channel and member.
+
+    Attributes:
+        bot (commands.Bot): The instance of the Redbot bot.
+        positives (frozenset): Answers that mean yes.
+        negatives (frozenset): Answers that mean no.
+    """
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.positives = frozenset(ExtendedMessagePredicate.POSITIVES)
+        self.negatives = frozenset(ExtendedMessagePredicate.NEGATIVES)
+
+        # {(channel ID, user ID): waiters, oldest first}
+        self.waiters: Dict[Tuple[int, int], Deque[asyncio.Future]] = defaultdict(deque)
+        self.listening = False
+
+    def start(self):
+        """Start listening to messages."""
+        if not self.listening:
+            self.bot.add_listener(self.on_message, "on_message")
+            self.listening = True
+
+    def stop(self):
+        """Stop listening to messages and cancel everything still waiting."""
+        if self.listening:
+            self.bot.remove_listener(self.on_message, "on_message")
+            self.listening = False
+        for waiters in self.waiters.values():
+            for future in waiters:
+                future.cancel()
+        self.waiters.clear()
+
+    def get_answer(self, content: str) -> Optional[bool]:
+        """Get whether a message means yes or no, or None if it's neither."""
+        content = content.strip().lower()
+        if content in self.positives:
+            return True
+        if content in self.negatives:
+            return False
+        return None
+
+    async def wait_for_answer(
+        self,
+        channel: discord.abc.Messageable,
+        user: discord.abc.User,
+        timeout: Optional[float] = None,
+    ) -> bool:
+        """Wait for a user to answer yes or no in a channel.
+
+        If several commands are waiting on the same user in the same channel, each
+        answer goes to the one that has waited the longest.
+
+        Args:
+            channel (discord.abc.Messageable): The channel the answer is expected in.
+            user (discord.abc.User): The user expected to answer.
+            timeout (Optional[float]): Seconds to wait, or None to wait forever.
+
+        Raises:
+            asyncio.TimeoutError: If the user doesn't answer in time.
+
+        Returns:
+            bool: True for yes, False for no.
+        """
+        self.start()
+        key = (channel.id, user.id)
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[key].append(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            waiters = self.waiters.get(key)
+            if waiters is not None:
+                try:
+                    waiters.remove(future)
+                except ValueError:
+                    pass
+                if not waiters:
+                    del self.waiters[key]
+
+    async def on_message(self, message: discord.Message):
+        waiters = self.waiters.get((message.channel.id, message.author.id))
+        if not waiters:
+            return
+
+        answer = self.get_answer(message.content)
+        if answer is None:
+            return
+
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():
+                future.set_result(answer)
+                return
@@ -6,9 +6,10 @@ Roleplay action commands are defined as individual YAML files in "actions" subfo
 """
 
 import logging
+import pickle
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import Dict, FrozenSet, List, Optional, Tuple, Union
 
 import yaml
 
@@ -21,18 +22,62 @@ class Denial:
 
     Attributes:
         roles (List[int]): List of role IDs that would prevent the action from being
-        completed successfully.
+        completed successfully. Role names and constants like "const.LOCKED" can be
+        used too, and several IDs or constants can be separated by spaces.
         message (str): The message displayed when the action is denied.
         Ex: "{invoker_member} can't ___ {target_member} in their current state."
+        role_ids (FrozenSet[int]): The roles resolved to IDs when the action loads.
+        role_names (FrozenSet[str]): Roles given by name instead of ID.
     """
 
     message: str
     roles: Union[List[str], str] = field(default_factory=list)
+    role_ids: FrozenSet[int] = field(init=False, default=frozenset(), repr=False)
+    role_names: FrozenSet[str] = field(init=False, default=frozenset(), repr=False)
 
     def __post_init__(self):
-        if isinstance(self.roles, str):
+        if self.roles is None:
+            self.roles = []
+        elif isinstance(self.roles, (str, int)):
             self.roles = [self.roles]
 
+        role_ids = set()
+        role_names = set()
+        for role in self.roles:
+            for key in self.split_role(role):
+                role_id = self.resolve_role(key)
+                if role_id is not None:
+                    role_ids.add(role_id)
+                elif isinstance(key, str) and key.startswith("const."):
+                    logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+                    logger.warning(f'Unknown "Denial" role: {key}')
+                else:
+                    role_names.add(key)
+        self.role_ids = frozenset(role_ids)
+        self.role_names = frozenset(role_names)
+
+    @staticmethod
+    def split_role(role: Union[int, str]) -> List[Union[int, str]]:
+        """Split a string of role IDs or constants, keeping role names whole."""
+        if not isinstance(role, str):
+            return [role]
+        keys = role.split()
+        if keys and all(key.isdigit() or key.startswith("const.") for key in keys):
+            return keys
+        return [role.strip()]
+
+    @staticmethod
+    def resolve_role(key: Union[int, str]) -> Optional[int]:
+        """Get the role ID of an ID or constant, or None if it's a role name."""
+        if isinstance(key, int):
+            return key
+        if key.isdigit():
+            return int(key)
+        if key.startswith("const."):
+            value = getattr(const, key[len("const.") :], None)
+            return value if isinstance(value, int) else None
+        return None
+
 
 @dataclass
 class Consent:
@@ -71,6 +116,7 @@ class Action:
         images (Optional[list]): URL for a gif(s) that represents the action.
         consent (Optional[Consent]): If this is included, the action requires consent. Under this property, messages to ask for consent can be defined.
         denial (Optional[Denial]): If this is included, roles can be defined that would prevent the action from being completed successfully.
+        image_urls (List[str]): The image URLs from the YAML file. Unlike images, these aren't replaced by locally cached files.
     """
 
     name: str
@@ -82,6 +128,7 @@ class Action:
     images: Union[List[str], str] = field(default_factory=list)
     consent: Optional[Consent] = None
     denial: Optional[Denial] = None
+    image_urls: List[str] = field(default_factory=list, repr=False)
 
     def __post_init__(self):
         if self.description is None:
@@ -94,6 +141,8 @@ class Action:
             self.aliases = [self.aliases]
         if isinstance(self.images, str):
             self.images = [self.images]
+        if not self.image_urls:
+            self.image_urls = list(self.images)
         if isinstance(self.consent, dict):
             try:
                 self.consent = Consent(**self.consent)
@@ -107,14 +156,30 @@ class Action:
 
 
 class ActionManager:
+    """Loads the roleplay actions and looks them up by name or alias.
+
+    Parsed YAML data is saved to a snapshot in CACHE_DIR together with the
+    modification time and size of each file, so later loads only parse the files
+    that changed since.
+    """
+
     DATA_PATH = Path(__file__).parent / "actions"
+    CACHE_DIR = Path(__file__).parent / "cache"
+    SNAPSHOT_PATH = CACHE_DIR / "actions.pickle"
+    SNAPSHOT_VERSION = 1
+    # the C loader is much faster, but only there if PyYAML was built with libyaml
+    YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
     def __init__(self, parent=None):
         self.parent = parent
         self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
-        self.logger.setLevel = const.LOGGER_LEVEL
+        self.logger.setLevel(const.LOGGER_LEVEL)
 
         self.actions: List[Action] = []
+        # {lowercase action name or alias: Action}
+        self.index: Dict[str, Action] = {}
+        # {file name: {"key": file key, "data": parsed YAML}}, saved to the snapshot
+        self.files: Dict[str, dict] = {}
 
         self.load_all()
 
@@ -123,37 +188,174 @@ class ActionManager:
         actions = "\n\t".join(actions)
         return f"ActionManager: {actions}"
 
-    def load(self, action_name: str, file_path: Union[str | Path] = None) -> Action:
-        if not file_path:
-            file_path = Path(self.DATA_PATH) / f"{action_name}.yml"
-
+    def parse(self, file_path: Path) -> Optional[dict]:
+        """Parse an action YAML file. Returns None if it can't be parsed."""
         with open(file_path, "r") as file:
             try:
-                data = yaml.safe_load(file)
-            except:
+                return yaml.load(file, Loader=self.YAML_LOADER)
+            except yaml.YAMLError:
                 self.logger.error(f"Error trying to parse {file_path}!")
                 return None
-            action = Action(name=action_name, **data)
 
-            return action
+    def load(self, action_name: str, file_path: Union[str | Path] = None) -> Action:
+        if not file_path:
+            file_path = Path(self.DATA_PATH) / f"{action_name}.yml"
 
-    def load_all(self):
-        yaml_files = (
-            file
+        data = self.parse(file_path)
+        if data is None:
+            return None
+        return Action(name=action_name, **data)
+
+    @staticmethod
+    def get_file_key(file_path: Path) -> Tuple[int, int]:
+        """Values a file's snapshot entry has to match to still be valid."""
+        stat = file_path.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    def load_snapshot(self) -> Dict[str, dict]:
+        """Load the parsed files from the snapshot. Returns {} if it's missing or stale.
+
+        Returns:
+            Dict[str, dict]: {file name: {"key": file key, "data": parsed YAML}}
+        """
+        try:
+            with open(self.SNAPSHOT_PATH, "rb") as file:
+                snapshot = pickle.load(file)
+        except FileNotFoundError:
+            return {}
+        except (
+            OSError,
+            pickle.UnpicklingError,
+            EOFError,
+            ValueError,
+            AttributeError,
+            TypeError,
+            ImportError,
+            IndexError,
+        ) as e:
+            # truncated, or written by something else
+            self.logger.warning(f"Unable to read the action snapshot: {e!r}")
+            return {}
+
+        if (
+            not isinstance(snapshot, dict)
+            or snapshot.get("version") != self.SNAPSHOT_VERSION
+            or not isinstance(snapshot.get("files"), dict)
+        ):
+            return {}
+        return snapshot["files"]
+
+    def save_snapshot(self, files: Dict[str, dict]):
+        """Save the parsed files so the next load doesn't need to parse them again."""
+        snapshot = {"version": self.SNAPSHOT_VERSION, "files": files}
+        try:
+            self.CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            temp_path = self.SNAPSHOT_PATH.with_suffix(".tmp")
+            with open(temp_path, "wb") as file:
+                pickle.dump(snapshot, file, protocol=pickle.HIGHEST_PROTOCOL)
+            temp_path.replace(self.SNAPSHOT_PATH)
+        except OSError as e:
+            self.logger.warning(f"Unable to save the action snapshot: {e}")
+
+    def get_file_keys(self) -> Dict[Path, Tuple[int, int]]:
+        """Get the key of every action file, to tell which ones changed."""
+        return {
+            file_path: self.get_file_key(file_path)
             for pattern in ("*.yaml", "*.yml")
-            for file in self.DATA_PATH.glob(pattern)
-        )
-
-        for file_path in yaml_files:
-            action_name = file_path.stem
-            action = self.load(action_name, file_path=file_path)
+            for file_path in sorted(self.DATA_PATH.glob(pattern))
+        }
 
-            if not action:
+    def load_all(self):
+        snapshot = self.load_snapshot()
+        self.files = {}
+        parsed = 0
+        for file_path, file_key in self.get_file_keys().items():
+            entry = snapshot.get(file_path.name)
+            if not isinstance(entry, dict) or entry.get("key") != file_key:
+                entry = {"key": file_key, "data": self.parse(file_path)}
+                parsed += 1
+            self.files[file_path.name] = entry
+
+            if entry["data"] is None:
                 continue
+            self.add(Action(name=file_path.stem, **entry["data"]))
 
-            self.actions.append(action)
-            # add property as pointer to the action
-            setattr(self, action_name, action)
+        # save again if any file was parsed, added or removed
+        if parsed or self.files.keys() != snapshot.keys():
+            self.save_snapshot(self.files)
+        self.logger.debug(
+            f"Loaded {len(self.actions)} actions, parsed {parsed} action files."
+        )
+
+    def add(self, action: Action):
+        """Add an action and index it by its name and aliases."""
+        self.actions.append(action)
+        self.index_action(action)
+
+    def index_action(self, action: Action):
+        for name in [action.name, *action.aliases]:
+            key = name.lower()
+            if key in self.index and self.index[key] is not action:
+                self.logger.warning(
+                    f'"{name}" of {action.name} is already used by '
+                    f"{self.index[key].name}!"
+                )
+                continue
+            self.index[key] = action
+        # add property as pointer to the action
+        setattr(self, action.name, action)
+
+    def unindex_action(self, action: Action):
+        for key in [key for key, value in self.index.items() if value is action]:
+            del self.index[key]
+        if getattr(self, action.name, None) is action:
+            delattr(self, action.name)
+
+    def replace(
+        self, file_path: Path, file_key: Tuple[int, int], data: Optional[dict]
+    ) -> Optional[Action]:
+        """Swap in the action of a changed file, keeping its place in the list.
+
+        Args:
+            file_path (Path): The action file.
+            file_key (Tuple[int, int]): Key of the file when it was parsed.
+            data (Optional[dict]): The parsed file.
+
+        Returns:
+            Optional[Action]: The new action, or None if the data isn't valid, in which
+            case the old action is kept.
+        """
+        if data is None:
+            return None
+        try:
+            action = Action(name=file_path.stem, **data)
+        except TypeError as e:
+            self.logger.error(f"Bad action data in {file_path}: {e}")
+            return None
+
+        old_action = self.index.get(action.name.lower())
+        if old_action is not None and old_action.name == action.name:
+            self.unindex_action(old_action)
+            self.actions[self.actions.index(old_action)] = action
+            self.index_action(action)
+        else:
+            self.add(action)
+
+        self.files[file_path.name] = {"key": file_key, "data": data}
+        self.save_snapshot(self.files)
+        return action
+
+    def remove(self, file_path: Path) -> Optional[Action]:
+        """Remove the action of a deleted file."""
+        self.files.pop(file_path.name, None)
+        self.save_snapshot(self.files)
+
+        action = self.index.get(file_path.stem.lower())
+        if action is None or action.name != file_path.stem:
+            return None
+        self.unindex_action(action)
+        self.actions.remove(action)
+        return action
 
     def update_images(self, action: Action):
         image_path = self.parent.user_settings.data_path / "images"
@@ -179,10 +381,11 @@ class ActionManager:
         for action in self.actions:
             self.update_images(action)
 
-    def get(self, action_name):
-        for action in self.actions:
-            if action.name == action_name:
-                return action
+    def get(self, action_name: str) -> Optional[Action]:
+        """Get an action by its name or one of its aliases."""
+        action = self.index.get(action_name.lower())
+        if action is not None:
+            return action
 
         self.logger.warning(f'Unable to find action "{action_name}"!')
         return None
@@ -0,0 +1,238 @@
+"""Consent engine for roleplay actions
+
+All of the consent prompts an action needs are sent at once and the answers are
+awaited concurrently with a single deadline. The first refusal ends the request, and
+pending requests are tracked per guild so they can be cancelled and capped.
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import discord
+from redbot.core import commands
+
+from . import const
+from .unicornia import strings
+from .unicornia.consent import ConsentDispatcher
+
+
+class ConsentLimitReached(Exception):
+    """Raised when a guild already has too many consent requests waiting."""
+
+
+@dataclass
+class ConsentPrompt:
+    """A message asking one or more members for consent.
+
+    Attributes:
+        message (str): The message sent to the channel.
+        responders (List[discord.Member]): Members who all have to consent.
+        refusal (str): Message sent if one of them refuses. Can use an {owner} tag for
+            the member who refused.
+    """
+
+    message: str
+    responders: List[discord.Member]
+    refusal: str
+
+
+@dataclass(eq=False)
+class PendingConsent:
+    """A consent request that's waiting for answers.
+
+    Attributes:
+        id (int): Unique ID of the request.
+        guild_id (int): The guild the request was made in.
+        channel_id (int): The channel the prompts were sent to.
+        invoker_id (int): The member who invoked the action.
+        prompts (List[ConsentPrompt]): The prompts that were sent.
+        deadline (float): Time the request times out at, from time.monotonic().
+        answers (Dict[int, bool]): Answers received so far, by member ID.
+        cancelled (asyncio.Event): Set when the request is cancelled.
+    """
+
+    id: int
+    guild_id: int
+    channel_id: int
+    invoker_id: int
+    prompts: List[ConsentPrompt]
+    deadline: float
+    answers: Dict[int, bool] = field(default_factory=dict)
+    cancelled: asyncio.Event = field(default_factory=asyncio.Event)
+
+    @property
+    def responders(self) -> List[discord.Member]:
+        return [member for prompt in self.prompts for member in prompt.responders]
+
+    def involves(self, user_id: int) -> bool:
+        return user_id == self.invoker_id or any(
+            member.id == user_id for member in self.responders
+        )
+
+
+class ConsentEngine:
+    """Asks for consent from every member an action needs it from at the same time.
+
+    Attributes:
+        bot (commands.Bot): The instance of the Redbot bot.
+        dispatcher (ConsentDispatcher): Routes the answers to the waiting requests.
+        max_per_guild (int): Maximum number of consent requests waiting in a guild.
+    """
+
+    MAX_PER_GUILD = 10
+
+    def __init__(
+        self,
+        bot: commands.Bot,
+        dispatcher: ConsentDispatcher,
+        max_per_guild: int = MAX_PER_GUILD,
+    ):
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self.logger.setLevel(const.LOGGER_LEVEL)
+
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.max_per_guild = max_per_guild
+
+        # {guild ID: {request ID: PendingConsent}}
+        self.pending: Dict[int, Dict[int, PendingConsent]] = defaultdict(dict)
+        self.ids = itertools.count(1)
+
+    def get_pending(self, guild_id: int) -> List[PendingConsent]:
+        """Get the consent requests waiting in a guild."""
+        return list(self.pending.get(guild_id, {}).values())
+
+    async def request(
+        self,
+        ctx: commands.Context,
+        prompts: List[ConsentPrompt],
+        timeout: float = const.TIMEOUT,
+    ) -> bool:
+        """Send consent prompts and wait until everyone consents or someone doesn't.
+
+        Args:
+            ctx (commands.Context): The context of the command invocation.
+            prompts (List[ConsentPrompt]): Prompts to send. Every responder of every
+                prompt has to consent.
+            timeout (float): Seconds to wait for all of the answers.
+
+        Raises:
+            ConsentLimitReached: If the guild already has too many requests waiting.
+
+        Returns:
+            bool: True if everyone consented, False otherwise.
+        """
+        guild_id = ctx.guild.id if ctx.guild else 0
+        guild_pending = self.pending[guild_id]
+        if len(guild_pending) >= self.max_per_guild:
+            raise ConsentLimitReached(
+                f"{len(guild_pending)} consent requests are already waiting."
+            )
+
+        pending = PendingConsent(
+            id=next(self.ids),
+            guild_id=guild_id,
+            channel_id=ctx.channel.id,
+            invoker_id=ctx.author.id,
+            prompts=prompts,
+            deadline=time.monotonic() + timeout,
+        )
+        guild_pending[pending.id] = pending
+
+        waiters: Dict[asyncio.Task, Tuple[ConsentPrompt, discord.Member]] = {}
+        cancelled = asyncio.create_task(pending.cancelled.wait())
+        try:
+            # start listening before the prompts go out so no answer is missed
+            for prompt in prompts:
+                for member in prompt.responders:
+                    task = asyncio.create_task(self.wait_for_answer(ctx, member))
+                    waiters[task] = (prompt, member)
+            # in order, so the prompts read the way they're listed. The waiters are
+            # already running and the deadline was set above, so the time spent
+            # sending comes out of the same timeout
+            for prompt in prompts:
+                await ctx.send(prompt.message)
+
+            return await self.collect(ctx, pending, waiters, cancelled)
+        finally:
+            for task in itertools.chain(waiters, [cancelled]):
+                task.cancel()
+            del guild_pending[pending.id]
+            if not guild_pending:
+                del self.pending[guild_id]
+
+    async def collect(
+        self,
+        ctx: commands.Context,
+        pending: PendingConsent,
+        waiters: Dict[asyncio.Task, Tuple[ConsentPrompt, discord.Member]],
+        cancelled: asyncio.Task,
+    ) -> bool:
+        """Wait for the answers until someone refuses, time runs out or it's cancelled."""
+        remaining = set(waiters)
+        while remaining:
+            timeout = pending.deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            done, _ = await asyncio.wait(
+                remaining | {cancelled},
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if cancelled in done:
+                self.logger.debug(f"Consent request {pending.id} was cancelled.")
+                return False
+
+            for task in done:
+                remaining.discard(task)
+                prompt, member = waiters[task]
+                pending.answers[member.id] = task.result()
+                if not task.result():
+                    await ctx.send(
+                        strings.format_string(
+                            prompt.refusal, owner=f"**{member.display_name}**"
+                        )
+                    )
+                    return False
+
+        if remaining:
+            waiting_on = [waiters[task][1].display_name for task in remaining]
+            await ctx.send(
+                const.TIMEOUT_MESSAGE.format(user=f"**{' & '.join(waiting_on)}**")
+            )
+            return False
+        return True
+
+    async def wait_for_answer(
+        self, ctx: commands.Context, member: discord.Member
+    ) -> bool:
+        """Wait for a member to answer yes or no in the channel."""
+        return await self.dispatcher.wait_for_answer(ctx.channel, member)
+
+    def cancel(self, guild_id: int, user_id: Optional[int] = None) -> int:
+        """Cancel the consent requests in a guild.
+
+        Args:
+            guild_id (int): The guild to cancel requests in.
+            user_id (Optional[int]): Only cancel requests this user invoked or was
+                asked to answer. Cancels every request in the guild if not given.
+
+        Returns:
+            int: The number of requests cancelled.
+        """
+        cancelled = 0
+        for pending in self.get_pending(guild_id):
+            if user_id is None or pending.involves(user_id):
+                pending.cancelled.set()
+                cancelled += 1
+        return cancelled
+
+    def cancel_all(self):
+        """Cancel every consent request, e.g. when the cog unloads."""
+        for guild_id in list(self.pending):
+            self.cancel(guild_id)
@@ -41,6 +41,10 @@ FREE_USE = 6960
 PETPLAY = 9031
 PET = 694788853419999352
 
+# largest file in bytes the bot can attach to a message in a server without boosts.
+# Larger action images are downscaled before they're sent
+UPLOAD_LIMIT = 10 * 1024 * 1024
+
 # seconds to delete any settings messages sent to user in private message short time
 # would be used in any public-facing channel, to keep them from being too cluttered.
 # long delete times would be used for ephemeral responses or private messages
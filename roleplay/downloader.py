@@ -0,0 +1,331 @@
+"""Downloads roleplay action images into the cog's data folder
+
+Images are downloaded concurrently on the bot's event loop with a shared aiohttp
+session. A manifest in the images folder remembers the ETag, Last-Modified and
+content hash of every URL, so later runs only re-download images that changed and
+never write the same image twice.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+import discord
+
+from . import const
+from .actions import Action
+
+
+@dataclass
+class DownloadResult:
+    """Counts of what happened to each image URL during a download run.
+
+    Attributes:
+        downloaded (int): New or changed images written to disk.
+        not_modified (int): Images the server reported as unchanged.
+        duplicates (int): Images whose content was already saved from another URL.
+        failed (List[str]): URLs that couldn't be downloaded.
+    """
+
+    downloaded: int = 0
+    not_modified: int = 0
+    duplicates: int = 0
+    failed: List[str] = field(default_factory=list)
+
+    @property
+    def total(self) -> int:
+        return self.downloaded + self.not_modified + self.duplicates + len(self.failed)
+
+
+class ImageDownloader:
+    """Downloads action images concurrently, with retries and conditional requests.
+
+    Attributes:
+        session (aiohttp.ClientSession): Session shared with the rest of the cog.
+        images_path (Path): Folder images are saved to, one sub-folder per action.
+        concurrency (int): Maximum number of downloads running at the same time.
+        retries (int): Number of times a failed download is retried.
+    """
+
+    CONCURRENCY = 4
+    RETRIES = 3
+    # seconds to wait before the first retry, doubled after each attempt
+    BACKOFF = 1.0
+    TIMEOUT = 30
+    MANIFEST_NAME = "manifest.json"
+    # status codes worth retrying, everything else fails straight away
+    RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+    NEW = "new"
+    NOT_MODIFIED = "not_modified"
+    DUPLICATE = "duplicate"
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        images_path: Path,
+        concurrency: int = CONCURRENCY,
+        retries: int = RETRIES,
+    ):
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self.logger.setLevel(const.LOGGER_LEVEL)
+
+        self.session = session
+        self.images_path = Path(images_path)
+        self.concurrency = max(1, concurrency)
+        self.retries = max(0, retries)
+
+        self.manifest_path = self.images_path / self.MANIFEST_NAME
+        # {url: {"file": ..., "etag": ..., "last_modified": ..., "sha256": ...}}
+        self.urls: Dict[str, dict] = {}
+        # {sha256: file path relative to images_path}
+        self.hashes: Dict[str, str] = {}
+
+    def load_manifest(self):
+        """Load the manifest and hash any saved images it doesn't know about yet."""
+        try:
+            self.urls = json.loads(self.manifest_path.read_text()).get("urls", {})
+        except (OSError, ValueError):
+            self.urls = {}
+
+        # forget images that were deleted since the last run
+        self.urls = {
+            url: entry
+            for url, entry in self.urls.items()
+            if (self.images_path / entry["file"]).is_file()
+        }
+        self.hashes = {entry["sha256"]: entry["file"] for entry in self.urls.values()}
+
+        # images saved before there was a manifest still count as cached
+        known_files = set(self.hashes.values())
+        for file_path in self.images_path.glob("*/*"):
+            relative_path = file_path.relative_to(self.images_path).as_posix()
+            if file_path.is_file() and relative_path not in known_files:
+                digest = hashlib.sha256(file_path.read_bytes()).hexdigest()
+                self.hashes.setdefault(digest, relative_path)
+
+    def save_manifest(self):
+        """Write the manifest, replacing the old one in a single step."""
+        self.images_path.mkdir(parents=True, exist_ok=True)
+        temp_path = self.manifest_path.with_suffix(".tmp")
+        temp_path.write_text(json.dumps({"urls": self.urls}, indent=2))
+        temp_path.replace(self.manifest_path)
+
+    async def download_all(
+        self,
+        actions: Iterable[Action],
+        progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+    ) -> DownloadResult:
+        """Download the images of every action.
+
+        Args:
+            actions (Iterable[Action]): Actions whose image_urls are downloaded.
+            progress (Optional[Callable]): Awaited with (done, total) after each image.
+
+        Returns:
+            DownloadResult: What happened to the image URLs.
+        """
+        await asyncio.to_thread(self.load_manifest)
+
+        jobs = [
+            (action, url)
+            for action in actions
+            for url in action.image_urls
+            if urlparse(url).scheme in ("http", "https")
+        ]
+        result = DownloadResult()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(action: Action, url: str):
+            async with semaphore:
+                try:
+                    status = await self.download(action, url)
+                except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                    self.logger.error(f"{action.name} : Error downloading {url}: {e}")
+                    result.failed.append(url)
+                else:
+                    if status == self.NEW:
+                        result.downloaded += 1
+                    elif status == self.NOT_MODIFIED:
+                        result.not_modified += 1
+                    else:
+                        result.duplicates += 1
+
+            if progress is not None:
+                await progress(result.total, len(jobs))
+
+        try:
+            await asyncio.gather(*(run(action, url) for action, url in jobs))
+        finally:
+            await asyncio.to_thread(self.save_manifest)
+
+        return result
+
+    async def download(self, action: Action, url: str) -> str:
+        """Download a single image unless it's already cached.
+
+        Args:
+            action (Action): The action the image belongs to.
+            url (str): URL of the image.
+
+        Returns:
+            str: NEW, NOT_MODIFIED or DUPLICATE.
+        """
+        entry = self.urls.get(url)
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = await self.fetch(url, headers)
+        if response is None:
+            return self.NOT_MODIFIED
+        content, etag, last_modified = response
+
+        digest = hashlib.sha256(content).hexdigest()
+        if entry and entry["sha256"] == digest:
+            # the server doesn't support conditional requests
+            status = self.NOT_MODIFIED
+        elif digest in self.hashes:
+            status = self.DUPLICATE
+        else:
+            if entry and entry["sha256"] != digest:
+                # the image changed, replace the old file instead of adding another
+                relative_path = entry["file"]
+                self.hashes.pop(entry["sha256"], None)
+            else:
+                relative_path = self.get_file_name(action, url)
+            # claim the hash and file name before writing, so other downloads
+            # running meanwhile don't save the same image or use the same name
+            self.hashes[digest] = relative_path
+            await asyncio.to_thread(self.write_file, relative_path, content)
+            status = self.NEW
+            self.logger.debug(f"Image saved to {self.images_path / relative_path}")
+
+        self.urls[url] = {
+            "file": self.hashes[digest],
+            "etag": etag,
+            "last_modified": last_modified,
+            "sha256": digest,
+        }
+        return status
+
+    async def fetch(self, url: str, headers: dict):
+        """Request an image, retrying with backoff on timeouts and server errors.
+
+        Returns:
+            None if the server says the image hasn't changed, otherwise a tuple of
+            (content, etag, last_modified).
+        """
+        timeout = aiohttp.ClientTimeout(total=self.TIMEOUT)
+        # some image hosts (https://panel.unicornia.net) fail certificate checks
+        ssl = None
+        attempt = 0
+        while True:
+            try:
+                async with self.session.get(
+                    url, headers=headers, timeout=timeout, ssl=ssl
+                ) as response:
+                    if response.status == 304:
+                        return None
+                    response.raise_for_status()
+                    content = await response.read()
+                    return (
+                        content,
+                        response.headers.get("ETag"),
+                        response.headers.get("Last-Modified"),
+                    )
+            except aiohttp.ClientSSLError:
+                if ssl is False:
+                    raise
+                self.logger.debug(
+                    f"SSL error for {url}, retrying without verification."
+                )
+                ssl = False
+            except aiohttp.ClientResponseError as e:
+                if e.status not in self.RETRY_STATUSES or attempt >= self.retries:
+                    raise
+                await self.wait_to_retry(url, attempt, e)
+                attempt += 1
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= self.retries:
+                    raise
+                await self.wait_to_retry(url, attempt, e)
+                attempt += 1
+
+    async def wait_to_retry(self, url: str, attempt: int, error: Exception):
+        delay = self.BACKOFF * 2**attempt
+        self.logger.debug(f"Retrying {url} in {delay}s ({error!r}).")
+        await asyncio.sleep(delay)
+
+    def get_file_name(self, action: Action, url: str) -> str:
+        """Get the next free "{action}_NN" file name for an image of the action."""
+        prefix = "SPOILER_" if action.spoiler else ""
+        suffix = Path(urlparse(url).path).suffix
+
+        taken = {entry["file"] for entry in self.urls.values()}
+        taken.update(self.hashes.values())
+        counter = 1
+        while True:
+            relative_path = f"{action.name}/{prefix}{action.name}_{counter:02}{suffix}"
+            if (
+                relative_path not in taken
+                and not (self.images_path / relative_path).exists()
+            ):
+                return relative_path
+            counter += 1
+
+    def write_file(self, relative_path: str, content: bytes):
+        file_path = self.images_path / relative_path
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        # write next to the action folders so a half-written file is never mistaken
+        # for an image
+        temp_path = self.images_path / f".{file_path.name}.part"
+        temp_path.write_bytes(content)
+        temp_path.replace(file_path)
+
+
+class ProgressMessage:
+    """Reports download progress by editing a single message in the channel.
+
+    Edits are throttled so large downloads don't run into Discord's rate limits. If
+    an edit fails, e.g. because the message was deleted, the progress stops being
+    reported and the download carries on.
+    """
+
+    INTERVAL = 2.0
+
+    def __init__(self, ctx, label: str):
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self.logger.setLevel(const.LOGGER_LEVEL)
+
+        self.ctx = ctx
+        self.label = label
+        self.message = None
+        self.last_edit = 0.0
+
+    async def start(self):
+        self.message = await self.ctx.send(f"{self.label}...")
+        self.last_edit = time.monotonic()
+
+    async def update(self, done: int, total: int):
+        if self.message is None:
+            return
+        now = time.monotonic()
+        if done < total and now - self.last_edit < self.INTERVAL:
+            return
+        self.last_edit = now
+        try:
+            await self.message.edit(content=f"{self.label}... {done}/{total}")
+        except discord.HTTPException as e:
+            self.logger.warning(f"Unable to update the progress message: {e}")
+            self.message = None
@@ -1,11 +1,12 @@
-import io
 from pathlib import Path
+from urllib.parse import urlparse
+
 import discord
-import requests
+
+from .image_cache import ImageCache
 
 
 class Embed:
-    CACHE_DIR = Path(__file__).parent / "image_cache"
 
     # @classmethod
     # def create(
@@ -34,48 +35,15 @@ class Embed:
     #     return embed
 
     @classmethod
-    def get_image(cls, url: str) -> Path:
-        cache_path = cls.CACHE_DIR / Path(url).name
-
-        if cache_path.exists():
-            return cache_path
-
-        try:
-            response = requests.get(url)
-        # put this here to resolve SSLError(SSLCertVerificationError with images on
-        # https://panel.unicornia.net
-        except:
-            response = requests.get(url, verify=False)
-
-        if response.status_code == 200:
-            cache_path.parent.mkdir(parents=True, exist_ok=True)
-            with open(cache_path, "wb") as file:
-                file.write(response.content)
-            return cache_path
-        else:
-            raise Exception(f"Failed to download image: {url}")
-
-    @classmethod
-    def spoiler_image(
-        cls, url: str, embed: discord.Embed
+    async def spoiler_image(
+        cls, url: str, embed: discord.Embed, cache: ImageCache
     ) -> tuple[discord.Embed, discord.File]:
-        image_path = cls.get_image(url)
-        file_extension = image_path.suffix
-
-        with image_path.open("rb") as file:
-            file_content = file.read()
+        file_extension = Path(urlparse(url).path).suffix
 
         file = discord.File(
-            io.BytesIO(file_content),
+            await cache.open(url),
             filename=f"SPOILER_image{file_extension}",
             spoiler=True,
         )
         # embed.set_image(url=f"attachment://SPOILER_image{file_extension}")
         return embed, file
-
-
-if __name__ == "__main__":
-    # Example usage
-    image_url = "https://cdn.weeb.sh/images/rJaog0FtZ.gif"
-    cached_image_path = Embed.get_image(image_url)
-    print(f"Cached image path: {cached_image_path}")
@@ -28,13 +28,13 @@ class UsersGroup(commands.Group):
 
 
 class Help:
-    def __init__(self, bot=None, parent=None, action_manager=ActionManager()):
+    def __init__(self, bot=None, parent=None, action_manager: ActionManager = None):
         self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
         self.logger.setLevel(const.LOGGER_LEVEL)
 
         self.bot = bot
         self.parent = parent
-        self.action_manager = action_manager
+        self.action_manager = action_manager or ActionManager()
 
     @property
     def bot_avatar_url(self):
@@ -0,0 +1,399 @@
+"""Content-addressed cache for images the roleplay cog attaches to messages
+
+Images are saved under a hash of their URL, so different hosts serving files with the
+same name don't collide. The cache is kept under a size and age budget by evicting
+the least recently used images, and the hottest small images are also kept in memory.
+Larger images are memory-mapped once and shared by every attachment that sends them.
+File system calls run in a thread, so a slow disk doesn't stall the event loop: last
+use times are written to the files in batches, and evicted files are deleted after
+each download.
+"""
+
+import asyncio
+import hashlib
+import io
+import logging
+import mmap
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+
+from . import const
+
+
+class MappedFile(io.RawIOBase):
+    """Read-only file object over a shared memory map.
+
+    Every attachment gets its own MappedFile, with its own position, over the same map,
+    so sending a cached image doesn't read or copy the whole file.
+    """
+
+    def __init__(self, mapped: mmap.mmap):
+        self.view = memoryview(mapped)
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.position = max(0, offset)
+        return self.position
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self.view) if size is None or size < 0 else self.position + size
+        data = bytes(self.view[self.position : end])
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.view[self.position : self.position + len(buffer)]
+        memoryview(buffer).cast("B")[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.view.release()
+        super().close()
+
+
+@dataclass
+class CacheEntry:
+    """An image saved in the cache.
+
+    Attributes:
+        size (int): Size of the file in bytes.
+        last_used (float): Time the image was last used, as a timestamp.
+    """
+
+    size: int
+    last_used: float
+
+
+class ImageCache:
+    """On-disk image cache with LRU eviction and a small in-memory tier.
+
+    Attributes:
+        session (aiohttp.ClientSession): Session used to download images.
+        cache_dir (Path): Folder the images are saved in.
+        max_size (int): Maximum total size of the cached images in bytes.
+        max_age (float): Seconds an unused image is kept for.
+        memory_size (int): Maximum total size of the images kept in memory in bytes.
+    """
+
+    CACHE_DIR = Path(__file__).parent / "image_cache"
+    MAX_SIZE = 256 * 1024 * 1024
+    MAX_AGE = 30 * 24 * 60 * 60
+    MEMORY_SIZE = 32 * 1024 * 1024
+    # larger images are only read from disk
+    MEMORY_MAX_FILE_SIZE = 4 * 1024 * 1024
+    TIMEOUT = 30
+    # seconds between writes of the last use times to the files
+    FLUSH_INTERVAL = 60
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        cache_dir: Path = CACHE_DIR,
+        max_size: int = MAX_SIZE,
+        max_age: float = MAX_AGE,
+        memory_size: int = MEMORY_SIZE,
+    ):
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self.logger.setLevel(const.LOGGER_LEVEL)
+
+        self.session = session
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self.max_age = max_age
+        self.memory_size = memory_size
+
+        # cached files by key, least recently used first
+        self.entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.total_size = 0
+        self.loaded = False
+
+        # image content by key, least recently used first
+        self.memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self.memory_used = 0
+        # memory maps of the images too large to keep in memory, by key
+        self.mapped: Dict[str, mmap.mmap] = {}
+
+        # downloads in progress, so concurrent misses for a URL share one request
+        self.pending: Dict[str, asyncio.Future] = {}
+
+        # {key: last use time} not yet written to the files
+        self.used: Dict[str, float] = {}
+        self.flush_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def get_key(url: str) -> str:
+        """Get the cache key for a URL, a hash of the URL plus its file extension."""
+        suffix = Path(urlparse(url).path).suffix.lower()
+        return hashlib.sha256(url.encode()).hexdigest() + suffix
+
+    def get_path(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    def load(self):
+        """Index the files already in the cache folder."""
+        entries = []
+        if self.cache_dir.is_dir():
+            for file_path in self.cache_dir.iterdir():
+                if not file_path.is_file() or file_path.suffix == ".part":
+                    continue
+                stat = file_path.stat()
+                entries.append(
+                    (file_path.name, CacheEntry(stat.st_size, stat.st_mtime))
+                )
+
+        entries.sort(key=lambda item: item[1].last_used)
+        self.entries = OrderedDict(entries)
+        self.total_size = sum(entry.size for entry in self.entries.values())
+        self.loaded = True
+        self.delete_files(self.evict())
+
+    async def get(self, url: str, remember: bool = True) -> Path:
+        """Get the path of a cached image, downloading it if it isn't cached.
+
+        Args:
+            url (str): URL of the image.
+            remember (bool): Whether a downloaded image is also kept in memory. Images
+                that aren't about to be sent, e.g. while warming up, shouldn't push
+                the ones in use out of memory.
+
+        Returns:
+            Path: The cached file.
+        """
+        if not self.loaded:
+            await asyncio.to_thread(self.load)
+
+        key = self.get_key(url)
+        path = self.get_path(key)
+        # check the file off the event loop, the cache folder may be on a slow disk
+        if key in self.entries and await asyncio.to_thread(path.is_file):
+            self.touch(key)
+            return path
+
+        # another command is already downloading this image
+        while key in self.pending:
+            future = self.pending[key]
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # only this command was cancelled, not the download
+                if not future.cancelled():
+                    raise
+                # the command downloading it was cancelled, download it here instead
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        try:
+            path = await self.fetch(url, key, remember=remember)
+        except Exception as e:
+            future.set_exception(e)
+            # the exception is raised below, don't warn if nobody else was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(path)
+            return path
+        finally:
+            del self.pending[key]
+            # cancelled, so wake the commands waiting on this download instead of
+            # leaving them waiting forever
+            if not future.done():
+                future.cancel()
+
+    async def open(self, url: str) -> io.IOBase:
+        """Open a cached image for sending, without reading or copying it.
+
+        Small images are served from the bytes kept in memory and larger ones from a
+        memory map of the cached file. Both are shared by every caller.
+
+        Args:
+            url (str): URL of the image.
+
+        Returns:
+            io.IOBase: A new read-only file object for the image.
+        """
+        key = self.get_key(url)
+        content = self.memory.get(key)
+        mapped = self.mapped.get(key)
+        if content is None and mapped is None:
+            path = await self.get(url)
+            content = self.memory.get(key)
+            mapped = self.mapped.get(key)
+            if content is None and mapped is None:
+                entry = self.entries.get(key)
+                if entry is not None and entry.size > self.MEMORY_MAX_FILE_SIZE:
+                    mapped = await asyncio.to_thread(self.map_file, path)
+                    self.mapped[key] = mapped
+                else:
+                    content = await asyncio.to_thread(path.read_bytes)
+                    self.remember(key, content)
+        else:
+            self.touch(key)
+
+        if content is not None:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+            # BytesIO shares the bytes' buffer until it's written to
+            return io.BytesIO(content)
+        return MappedFile(mapped)
+
+    @staticmethod
+    def map_file(path: Path) -> mmap.mmap:
+        with open(path, "rb") as file:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    async def close(self):
+        """Save the last use times and drop the memory maps.
+
+        Attachments still being sent keep their memory maps open.
+        """
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        used, self.used = self.used, {}
+        await asyncio.to_thread(self.save_used, used)
+        self.mapped.clear()
+
+    def remember(self, key: str, content: bytes):
+        """Keep an image in memory, forgetting the least recently used ones."""
+        if len(content) > self.MEMORY_MAX_FILE_SIZE or len(content) > self.memory_size:
+            return
+
+        self.memory[key] = content
+        self.memory_used += len(content)
+        while self.memory_used > self.memory_size:
+            _, forgotten = self.memory.popitem(last=False)
+            self.memory_used -= len(forgotten)
+
+    def touch(self, key: str):
+        """Mark a cached image as used."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+        entry.last_used = time.time()
+        self.entries.move_to_end(key)
+        # the file's modification time is the last use time across restarts, it's
+        # written later with the other images used meanwhile
+        self.used[key] = entry.last_used
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_used())
+
+    async def flush_used(self):
+        """Write the last use times to the files after FLUSH_INTERVAL."""
+        try:
+            await asyncio.sleep(self.FLUSH_INTERVAL)
+        finally:
+            self.flush_task = None
+        used, self.used = self.used, {}
+        await asyncio.to_thread(self.save_used, used)
+
+    def save_used(self, used: Dict[str, float]):
+        for key, last_used in used.items():
+            try:
+                os.utime(self.get_path(key), (last_used, last_used))
+            except OSError:
+                pass
+
+    async def fetch(self, url: str, key: str, remember: bool = True) -> Path:
+        """Download an image into the cache, and into memory if remember is True."""
+        timeout = aiohttp.ClientTimeout(total=self.TIMEOUT)
+        try:
+            content = await self.request(url, timeout, ssl=None)
+        except aiohttp.ClientSSLError:
+            # put this here to resolve SSLError(SSLCertVerificationError with images
+            # on https://panel.unicornia.net
+            content = await self.request(url, timeout, ssl=False)
+
+        path = self.get_path(key)
+        await asyncio.to_thread(self.write_file, path, content)
+        evicted = self.add(key, len(content))
+        if remember:
+            self.remember(key, content)
+        if evicted:
+            await asyncio.to_thread(self.delete_files, evicted)
+        self.logger.debug(f"Cached {url} as {key}.")
+        return path
+
+    async def request(self, url: str, timeout: aiohttp.ClientTimeout, ssl) -> bytes:
+        async with self.session.get(url, timeout=timeout, ssl=ssl) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    def write_file(self, path: Path, content: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f"{path.name}.part")
+        temp_path.write_bytes(content)
+        temp_path.replace(path)
+
+    def add(self, key: str, size: int) -> List[str]:
+        """Add a newly written file to the index and keep the cache within budget.
+
+        Returns:
+            List[str]: The keys of the evicted images, whose files need deleting.
+        """
+        old_entry = self.entries.pop(key, None)
+        if old_entry is not None:
+            self.total_size -= old_entry.size
+        self.mapped.pop(key, None)
+        self.entries[key] = CacheEntry(size, time.time())
+        self.total_size += size
+        return self.evict()
+
+    def evict(self) -> List[str]:
+        """Remove expired images, then the least recently used until under budget.
+
+        Returns:
+            List[str]: The keys of the evicted images, whose files need deleting.
+        """
+        expired_time = time.time() - self.max_age
+        evicted = []
+        # always keep the most recently used image, even if it's over the budget
+        while len(self.entries) > 1:
+            key, entry = next(iter(self.entries.items()))
+            if self.total_size <= self.max_size and entry.last_used >= expired_time:
+                break
+            self.remove(key)
+            evicted.append(key)
+        return evicted
+
+    def delete_files(self, keys: List[str]):
+        for key in keys:
+            # downloaded again since it was evicted
+            if key in self.entries:
+                continue
+            try:
+                self.get_path(key).unlink()
+            except OSError:
+                pass
+
+    def remove(self, key: str):
+        entry = self.entries.pop(key)
+        self.total_size -= entry.size
+        content = self.memory.pop(key, None)
+        if content is not None:
+            self.memory_used -= len(content)
+        # the map stays valid for attachments still using it
+        self.mapped.pop(key, None)
+        self.used.pop(key, None)
+        self.logger.debug(f"Evicted {key} from the image cache.")
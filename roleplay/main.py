@@ -2,39 +2,69 @@
 
 import asyncio
 import logging
+import time
 from pathlib import Path
 from random import choice
-from typing import List
+from typing import Dict, List, Optional
 from urllib.parse import urlparse
 
+import aiohttp
 import discord
 from redbot.core import commands
 from redbot.core.bot import Red
+from redbot.core.utils.chat_formatting import box, pagify
 
 from . import __credits__, __version__, const
-from .actions import Action, ActionManager
+from .actions import Action, ActionManager, Denial
+from .consent import ConsentEngine, ConsentLimitReached, ConsentPrompt
+from .downloader import ImageDownloader, ProgressMessage
 from .embed import Embed
 from .help import Help
+from .image_cache import ImageCache
+from .metrics import Metrics
 from .settings import Settings
-from .unicornia import images, strings
-from .unicornia.predicates import ExtendedMessagePredicate
+from .unicornia import strings
+from .unicornia.consent import ConsentDispatcher
+from .users import UserSnapshot
+from .warmup import ImageWarmer
+from .watcher import ActionWatcher
 
 
 class Roleplay(commands.Cog):
     def __init__(self, bot: commands.Bot = Red):
+        start = time.perf_counter()
         self.bot = bot
 
         self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
         self.logger.setLevel(const.LOGGER_LEVEL)
 
+        # shared by everything in the cog that talks to the web
+        self.session = aiohttp.ClientSession()
+        # latency of each stage of the roleplay interactions
+        self.metrics = Metrics()
+        self.image_cache = ImageCache(self.session)
+        # checks the action images in the background once the data folder is known
+        self.image_warmer = None
+        self.warmup_task = None
+        # reloads action files that are edited while the cog is loaded
+        self.watch_task = None
+
+        # one message listener answers every consent request in the cog
+        self.consent_dispatcher = ConsentDispatcher(bot)
+        self.consent = ConsentEngine(bot, self.consent_dispatcher)
         self.action_manager = ActionManager(parent=self)
         self.helper = Help(bot=bot, parent=self, action_manager=self.action_manager)
         self.user_settings = Settings(bot=bot, parent=self, helper=self.helper)
 
+        # {action name: command}, so reloaded actions can replace their command
+        self.action_commands: Dict[str, commands.Command] = {}
         self.create_action_commands()
 
         self.logger.info("-" * 32)
-        self.logger.info(f"{self.__class__.__name__} v({__version__}) initialized!")
+        self.logger.info(
+            f"{self.__class__.__name__} v({__version__}) initialized in "
+            f"{(time.perf_counter() - start) * 1000:.0f}ms!"
+        )
         self.logger.info("-" * 32)
 
         # Asynchronously update the action_manager
@@ -48,6 +78,51 @@ class Roleplay(commands.Cog):
         # needed for action_manager
         self.user_settings.update()
         self.action_manager.update()
+        self.start_warmup()
+        await self.user_settings.users_manager.load_graph()
+        watcher = ActionWatcher(self.action_manager, self.on_action_change)
+        self.watch_task = asyncio.create_task(watcher.run())
+
+    async def on_action_change(self, action_name: str, action: Optional[Action]):
+        """Replace the command of an action that was reloaded, or remove it
+
+        The images of a reloaded action are checked again, like when the cog loads.
+
+        Args:
+            action_name (str): The name of the action.
+            action (Optional[Action]): The new action, or None if it was removed.
+        """
+        self.remove_action_command(action_name)
+        if action is not None:
+            self.action_manager.update_images(action)
+            self.create_action_command(action.name, action.help, action.aliases)
+            if self.image_warmer is not None:
+                await self.image_warmer.run([action])
+
+    def start_warmup(self):
+        """Check every action image in the background, replacing any earlier check."""
+        if self.warmup_task is not None:
+            self.warmup_task.cancel()
+        self.image_warmer = ImageWarmer(
+            self.action_manager,
+            self.image_cache,
+            self.session,
+            self.user_settings.data_path / "variants",
+        )
+        self.warmup_task = asyncio.create_task(self.image_warmer.run())
+
+    async def cog_unload(self):
+        self.consent.cancel_all()
+        self.consent_dispatcher.stop()
+        if self.warmup_task is not None:
+            self.warmup_task.cancel()
+        if self.watch_task is not None:
+            self.watch_task.cancel()
+        await self.image_cache.close()
+        await self.session.close()
+        # action commands are added to the bot directly, so aren't removed with the cog
+        for action_name in list(self.action_commands):
+            self.remove_action_command(action_name)
 
     @commands.group(invoke_without_command=True)
     async def roleplay(self, ctx: commands.Context):
@@ -72,19 +147,90 @@ class Roleplay(commands.Cog):
             return await ctx.send(msg)
 
     @admin.command()
-    async def download(self, ctx: commands.Context):
-        """Downloads all action images into the cog's data folder"""
-        images_path = self.user_settings.data_path / "images"
+    async def stats(self, ctx: commands.Context, action_name: Optional[str] = None):
+        """Shows how long each stage of the roleplay interactions takes
 
-        actions = self.action_manager.list()
-        for action_name in actions:
+        Shows p50/p95/p99 latency per stage across every action, and the total per
+        action. Give an action name to show its stages instead.
+        """
+        if action_name is not None:
             action = self.action_manager.get(action_name)
-            for image_URL in action.images:
-                images.save_image_from_url(
-                    image_URL, images_path, action_name, action.spoiler
+            if action is None:
+                return await ctx.send(f'There\'s no "{action_name}" action.')
+            action_name = action.name
+            tables = [
+                Metrics.format_table(
+                    "stage",
+                    [
+                        (stage, self.metrics.get(action_name, stage))
+                        for stage in Metrics.STAGES
+                    ],
                 )
+            ]
+        else:
+            action_name = "every action"
+            tables = [
+                Metrics.format_table(
+                    "stage",
+                    [
+                        (stage, self.metrics.get(Metrics.ALL, stage))
+                        for stage in Metrics.STAGES
+                    ],
+                ),
+                Metrics.format_table(
+                    "action (total)",
+                    [
+                        (name, self.metrics.get(name, Metrics.TOTAL))
+                        for name in self.metrics.actions()
+                    ],
+                ),
+            ]
 
-        await ctx.send(f"Roleplay action images downloaded to: {images_path}")
+        since = int(self.metrics.started)
+        await ctx.send(
+            f"Roleplay latency in ms for {action_name}, since <t:{since}:R>:"
+        )
+        for page in pagify("\n\n".join(tables)):
+            await ctx.send(box(page))
+
+    @admin.command()
+    async def purge(self, ctx: commands.Context, user_id: int):
+        """Removes a user from everyone's owners and allowed lists
+
+        Use it for users who left for good. Blocks are kept in case they come back.
+        """
+        removed = await self.user_settings.users_manager.purge_user(user_id)
+        msg = f"Removed user {user_id} from {removed} owners and allowed lists."
+        self.logger.info(msg)
+        await ctx.send(msg)
+
+    @admin.command()
+    async def download(
+        self, ctx: commands.Context, concurrency: int = ImageDownloader.CONCURRENCY
+    ):
+        """Downloads all action images into the cog's data folder
+
+        Images that are already downloaded and haven't changed are skipped.
+        """
+        images_path = self.user_settings.data_path / "images"
+        downloader = ImageDownloader(self.session, images_path, concurrency=concurrency)
+
+        progress = ProgressMessage(ctx, "Downloading roleplay action images")
+        await progress.start()
+        result = await downloader.download_all(
+            self.action_manager.actions, progress=progress.update
+        )
+
+        # use the downloaded images instead of the URLs
+        self.action_manager.update()
+        self.start_warmup()
+
+        msg = (
+            f"Roleplay action images downloaded to: {images_path}\n"
+            f"{result.downloaded} new, {result.not_modified} unchanged, "
+            f"{result.duplicates} duplicates, {len(result.failed)} failed."
+        )
+        await ctx.send(msg)
 
     @logger_settings.command(aliases=["level", "setlevel"])
     async def logger_set_level(self, ctx: commands.Context, level_name: str = None):
@@ -101,6 +247,19 @@ class Roleplay(commands.Cog):
         self.logger.info(msg)
         return await ctx.send(msg)
 
+    @roleplay.command(aliases=["nevermind"])
+    async def cancel(self, ctx: commands.Context):
+        """Cancel the consent requests you made or were asked to answer."""
+        if ctx.guild is None:
+            return
+        cancelled = self.consent.cancel(ctx.guild.id, ctx.author.id)
+        if cancelled:
+            plural = "s" if cancelled > 1 else ""
+            msg = f"Cancelled {cancelled} roleplay request{plural}."
+        else:
+            msg = f"{ctx.author.display_name} has no roleplay requests waiting."
+        await ctx.send(msg, delete_after=const.SHORT_DELETE_TIME)
+
     @roleplay.command(aliases=["help"])
     async def roleplay_help(self, ctx: commands.Context):
         """Subcommand for roleplay help"""
@@ -118,6 +277,12 @@ class Roleplay(commands.Cog):
         self.logger.debug("Default help for `roleplay settings` command intercepted.")
         return await self.helper.settings(ctx)
 
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        """Forget a member that left, so they're fetched again if they come back."""
+        users_manager = self.user_settings.users_manager
+        users_manager.member_cache.invalidate(member.guild.id, member.id)
+
     @commands.Cog.listener()
     async def on_command_error(
         self, ctx: commands.Context, error: commands.CommandError
@@ -140,9 +305,24 @@ class Roleplay(commands.Cog):
         for action in self.action_manager.actions:
             self.create_action_command(action.name, action.help, action.aliases)
 
+    def remove_action_command(self, action_name: str):
+        """Removes the command of a roleplay action from the bot and roleplay group
+
+        Args:
+            action_name (str): The name of the action.
+        """
+        command = self.action_commands.pop(action_name, None)
+        if command is None:
+            return
+        if self.bot.get_command(action_name) is command:
+            self.bot.remove_command(action_name)
+        if self.roleplay.get_command(action_name) is command:
+            self.roleplay.remove_command(action_name)
+        self.logger.debug(f'Removed "{action_name}" command.')
+
     def create_action_command(
         self, action_name: str, help_text: str, aliases: List[str]
-    ) -> None:
+    ) -> commands.Command:
         """Creates a new command for a roleplay action
 
         Args:
@@ -151,7 +331,7 @@ class Roleplay(commands.Cog):
             aliases (List[str]): A list of aliases for the command.
 
         Returns:
-            None
+            commands.Command: The new command.
         """
 
         # method needs to be defined here so it can be changed for each action
@@ -197,7 +377,7 @@ class Roleplay(commands.Cog):
         command_method.__doc__ = help_text
 
         # include capitalized version of command and aliases
-        aliases.extend([a.capitalize() for a in aliases])
+        aliases = [*aliases, *(a.capitalize() for a in aliases)]
         aliases.append(action_name.capitalize())
 
         command = commands.command(name=action_name, aliases=aliases)(command_method)
@@ -211,9 +391,15 @@ class Roleplay(commands.Cog):
         # group (&roleplay hug) but the individual commands do not show up in the redbot
         # help menu under "no category"
         setattr(self, action_name, command)
-        self.bot.add_command(command)
-        # Add the command to the roleplay group
-        self.roleplay.add_command(command)
+        try:
+            self.bot.add_command(command)
+            # Add the command to the roleplay group
+            self.roleplay.add_command(command)
+        except commands.CommandRegistrationError as e:
+            self.logger.error(f'Unable to register "{action_name}" command: {e}')
+        self.action_commands[action_name] = command
+        self.logger.debug(f'Created "{action_name}" command.')
+        return command
 
     @commands.command(aliases=["askfor", "get", "giveme", "gimme", "request"])
     async def ask(
@@ -262,6 +448,29 @@ class Roleplay(commands.Cog):
         invoker_member: discord.Member,
         target_member: discord.Member,
         interaction_type: const.InteractionType = const.InteractionType.ACTIVE,
+    ):
+        """Attempt an action and record how long it took, see run_interaction()"""
+        coroutine = self.run_interaction(
+            ctx,
+            action_name,
+            invoker_member,
+            target_member,
+            interaction_type=interaction_type,
+        )
+        action = self.action_manager.get(action_name)
+        # names that aren't actions come from users, so aren't recorded
+        if action is None:
+            return await coroutine
+        with self.metrics.span(action.name, Metrics.TOTAL):
+            return await coroutine
+
+    async def run_interaction(
+        self,
+        ctx: commands.Context,
+        action_name: str,
+        invoker_member: discord.Member,
+        target_member: discord.Member,
+        interaction_type: const.InteractionType = const.InteractionType.ACTIVE,
     ):
         """Attempt to perform an action on another member (or yourself)
 
@@ -290,23 +499,28 @@ class Roleplay(commands.Cog):
             )
             return False
 
-        # collection settings for invoker and target member
-        target_public = await self.user_settings.config.user(target_member).public()
-        target_servant = await self.user_settings.config.user(target_member).servant()
-        target_selective = await self.user_settings.config.user(
-            target_member
-        ).selective()
-        is_blocked = await self.check_blocked(ctx, invoker_member, target_member)
-        is_denied = await self.check_roles(ctx, invoker_member, target_member, action)
-        is_allowed = await self.user_settings.users_manager.in_group(
-            target_member, invoker_member, "allowed"
-        )
-        invoker_owner = await self.user_settings.users_manager.get_owner(
-            ctx, invoker_member
-        )
-        target_owner = await self.user_settings.users_manager.get_owner(
-            ctx, target_member
-        )
+        # collect settings for invoker and target member, with one read each
+        users_manager = self.user_settings.users_manager
+        with self.metrics.span(action.name, Metrics.SETTINGS):
+            invoker_settings, target_settings = await users_manager.get_snapshots(
+                invoker_member, target_member
+            )
+        target_public = target_settings.get("public")
+        target_servant = target_settings.get("servant")
+        target_selective = target_settings.get("selective")
+        with self.metrics.span(action.name, Metrics.CHECKS):
+            is_blocked = await self.check_blocked(
+                ctx, invoker_member, target_member, invoker_settings, target_settings
+            )
+            is_denied = await self.check_roles(
+                ctx, invoker_member, target_member, action
+            )
+            is_allowed = target_settings.in_group(invoker_member, "allowed")
+        with self.metrics.span(action.name, Metrics.OWNERS):
+            invoker_owner, target_owner = await asyncio.gather(
+                users_manager.get_owner(ctx, invoker_member, invoker_settings),
+                users_manager.get_owner(ctx, target_member, target_settings),
+            )
 
         self.logger.debug(
             f"""Ineraction:
@@ -397,15 +611,16 @@ class Roleplay(commands.Cog):
 
         if requires_consent:
             self.logger.debug(f"{action_name} consent is required")
-            has_consent = await self.ask_for_consent(
-                ctx,
-                invoker_member,
-                target_member,
-                action,
-                interaction_type=interaction_type,
-                invoker_owner=invoker_owner,
-                target_owner=target_owner,
-            )
+            with self.metrics.span(action.name, Metrics.CONSENT):
+                has_consent = await self.ask_for_consent(
+                    ctx,
+                    invoker_member,
+                    target_member,
+                    action,
+                    interaction_type=interaction_type,
+                    invoker_owner=invoker_owner,
+                    target_owner=target_owner,
+                )
             if has_consent is not True:
                 self.reset_cooldown(ctx, action_name)
                 return False
@@ -479,6 +694,11 @@ class Roleplay(commands.Cog):
         # TODO: This could be extended to get an image dynamically or allow for a single
         # URL as a string
         image = choice(action.images)
+        # send the downscaled copy of images that are too large to attach
+        variant = self.image_warmer.get_variant(image) if self.image_warmer else None
+        if variant is not None:
+            self.logger.debug(f"Using downscaled {variant} for {image}")
+            image = variant.as_posix()
         # Check if image_url_or_path is a URL
         parsed_url = urlparse(image)
         if parsed_url.scheme in ("http", "https"):
@@ -494,18 +714,26 @@ class Roleplay(commands.Cog):
         if action.spoiler:
             if parsed_url.scheme in ("http", "https"):
                 async with ctx.typing():
-                    embed, file = Embed.spoiler_image(image, embed)
+                    with self.metrics.span(action.name, Metrics.IMAGE):
+                        embed, file = await Embed.spoiler_image(
+                            image, embed, self.image_cache
+                        )
             else:
-                file = discord.File(fp=file_path, filename=file_path.name)
-            await ctx.send(description, file=file)
+                file = discord.File(
+                    fp=file_path, filename=file_path.name, spoiler=True
+                )
+            with self.metrics.span(action.name, Metrics.SEND):
+                await ctx.send(description, file=file)
         else:
             if parsed_url.scheme in ("http", "https"):
                 embed.set_image(url=image)
-                await ctx.send(embed=embed)
+                with self.metrics.span(action.name, Metrics.SEND):
+                    await ctx.send(embed=embed)
             else:
                 file = discord.File(fp=file_path, filename=file_path.name)
                 embed.set_image(url=f"attachment://{file_path.name}")
-                await ctx.send(embed=embed, file=file)
+                with self.metrics.span(action.name, Metrics.SEND):
+                    await ctx.send(embed=embed, file=file)
 
     async def delete_message(
         self, ctx: commands.Context, delay: int = const.SHORT_DELETE_TIME
@@ -538,13 +766,17 @@ class Roleplay(commands.Cog):
 
     def reset_cooldown(self, ctx: commands.Context, command_name: str):
         """Reset the cooldown for the invoking user."""
-        command = self.bot.get_command(command_name)
-        if command is not None:
-            bucket = command._buckets.get_bucket(ctx)
+        command = self.action_commands.get(command_name) or self.bot.get_command(
+            command_name
+        )
+        # e.g. the action was removed while its interaction was running
+        if command is None:
+            self.logger.debug(f'No "{command_name}" command to reset the cooldown of.')
+            return
+        bucket = command._buckets.get_bucket(ctx)
+        if bucket is not None:
             bucket.reset()
-            self.logger.debug(f'Reset cooldown on"{command_name}" command.')
-        else:
-            self.logger.error(f'Invalid command name: "{command_name}".')
+        self.logger.debug(f'Reset cooldown on"{command_name}" command.')
 
     async def check_roles(
         self,
@@ -559,45 +791,49 @@ class Roleplay(commands.Cog):
         # vs when a command is used on them
 
         # if no roleIDs are defined, there's nothing to check
-        if action.denial is None or action.denial.roles is None:
+        denial = action.denial
+        if not isinstance(denial, Denial) or not (denial.role_ids or denial.role_names):
             return False
 
         # check to see if the target member has any of the denial roles
-        # for this action
-        self.logger.debug(f"Auto denial role IDs: {action.denial.roles}")
-        for role_id in action.denial.roles:
-            if await self.user_settings.users_manager.has_role(
-                ctx, target_member, role_id
-            ):
-                self.logger.debug(
-                    f"Role ID:{role_id} in member roles. Action will be auto-denied"
-                )
-                deny_message = action.denial
-                deny_message = strings.format_string(
-                    deny_message,
-                    invoker_member=f"**{invoker_member.display_name}**",
-                    target_member=f"**{target_member.display_name}**",
-                )
-                self.logger.debug(f"deny_message: {deny_message}")
-                await ctx.send(deny_message)
-                return True
+        # for this action, with one set intersection
+        self.logger.debug(f"Auto denial role IDs: {denial.role_ids}")
+        roles = getattr(target_member, "roles", [])
+        denied_roles = denial.role_ids.intersection(role.id for role in roles)
+        if not denied_roles and denial.role_names:
+            denied_roles = denial.role_names.intersection(role.name for role in roles)
+        if not denied_roles:
+            return False
 
-        return False
+        self.logger.debug(
+            f"Roles {denied_roles} in member roles. Action will be auto-denied"
+        )
+        deny_message = strings.format_string(
+            denial.message,
+            invoker_member=f"**{invoker_member.display_name}**",
+            target_member=f"**{target_member.display_name}**",
+        )
+        self.logger.debug(f"deny_message: {deny_message}")
+        await ctx.send(deny_message)
+        return True
 
     async def check_blocked(
         self,
         ctx: commands.Context,
         invoker_member: discord.User,
         target_member: discord.User,
+        invoker_settings: Optional[UserSnapshot] = None,
+        target_settings: Optional[UserSnapshot] = None,
     ):
         # If the member calling the command is in the target member's blocked list, or
         # vice-versa send message that the command can't be used
-        target_member_blocked = await self.user_settings.users_manager.in_group(
-            invoker_member, target_member, "blocked"
-        )
-        invoker_member_blocked = await self.user_settings.users_manager.in_group(
-            target_member, invoker_member, "blocked"
-        )
+        users_manager = self.user_settings.users_manager
+        if invoker_settings is None:
+            invoker_settings = await users_manager.get_snapshot(invoker_member)
+        if target_settings is None:
+            target_settings = await users_manager.get_snapshot(target_member)
+        target_member_blocked = invoker_settings.in_group(target_member, "blocked")
+        invoker_member_blocked = target_settings.in_group(invoker_member, "blocked")
         is_blocked = invoker_member_blocked or target_member_blocked
         self.logger.debug(
             f"""Checking blocked status:
@@ -649,152 +885,69 @@ class Roleplay(commands.Cog):
                 ctx, target_member
             )
 
-        # if both invoker and target have owners, ask both for permission
-        if invoker_owner and target_owner:
-            owners_mention = f"**{invoker_owner.mention}** & **{target_owner.mention}**"
-            owners_display_name = (
-                f"{invoker_owner.display_name} & {target_owner.display_name}"
-            )
-            # interaction type is an Enum, so need it's value as string
-            consent_message = getattr(
-                action.consent, f"owners_{interaction_type.value}"
-            )
-            consent_message = f"{consent_message} {const.CONSENT_QUESTION}"
-            consent_message = strings.format_string(
-                consent_message,
-                owner=owners_mention,
-                invoker_member=f"**{invoker_member.display_name}**",
-                target_member=f"**{target_member.display_name}**",
-            )
-            self.logger.debug(f'consent_message : "{consent_message}"')
-            # send the consent message
-            await ctx.send(consent_message)
-
-            # wait for response from owner
-            pred = ExtendedMessagePredicate.yes_or_no(
-                ctx, ctx.channel, [invoker_owner, target_owner]
-            )
-            try:
-                await self.bot.wait_for("message", timeout=const.TIMEOUT, check=pred)
-            except asyncio.TimeoutError:
-                await ctx.send(const.TIMEOUT_MESSAGE.format(user=owners_display_name))
-                return False
+        invoker_name = f"**{invoker_member.display_name}**"
+        target_name = f"**{target_member.display_name}**"
+        owner_refusal = strings.format_string(
+            const.OWNER_REFUSAL_MESSAGE,
+            invoker_member=invoker_name,
+            target_member=target_name,
+        )
 
-            # if the either owner declines consent, send this message
-            if not pred.result:
-                refusal_message = const.OWNER_REFUSAL_MESSAGE.format(
-                    owner=target_owner.display_name,
-                    invoker_member=f"**{invoker_member.display_name}**",
-                    target_member=f"**{target_member.display_name}**",
-                )
-                await ctx.send(refusal_message)
-                return False
-            else:
-                return True
-        # if only the invoker has an owner
-        elif invoker_owner and invoker_owner != target_member:
+        def owner_prompt(owners: List[discord.Member]) -> ConsentPrompt:
+            # members with the same owner only need one answer from them, a second
+            # waiter for the same owner would never get one
+            owners = list({owner.id: owner for owner in owners}.values())
             # interaction type is an Enum, so need it's value as string
             consent_message = getattr(action.consent, f"owner_{interaction_type.value}")
             consent_message = f"{consent_message} {const.CONSENT_QUESTION}"
             consent_message = strings.format_string(
                 consent_message,
-                owner=invoker_owner.mention,
-                invoker_member=f"**{invoker_member.display_name}**",
-                target_member=f"**{target_member.display_name}**",
+                owner=" & ".join(
+                    f"**{owner.mention}**" if len(owners) > 1 else owner.mention
+                    for owner in owners
+                ),
+                invoker_member=invoker_name,
+                target_member=target_name,
             )
-            self.logger.debug(f'consent_message : "{consent_message}"')
-            await ctx.send(consent_message)
-
-            # wait for response from owner
-            pred = ExtendedMessagePredicate.yes_or_no(ctx, ctx.channel, invoker_owner)
-            try:
-                await self.bot.wait_for("message", timeout=const.TIMEOUT, check=pred)
-            except asyncio.TimeoutError:
-                await ctx.send(
-                    const.TIMEOUT_MESSAGE.format(
-                        user=f"**{invoker_owner.display_name}**"
-                    )
-                )
-                return False
-
-            # if the owner declines consent, send this message
-            if not pred.result:
-                refusal_message = const.OWNER_REFUSAL_MESSAGE.format(
-                    owner=invoker_owner.display_name,
-                    invoker_member=f"**{invoker_member.display_name}**",
-                    target_member=f"**{target_member.display_name}**",
-                )
-                await ctx.send(refusal_message)
-                return False
-
-            # don't return True here, as we still need to check the target for consent
+            return ConsentPrompt(consent_message, owners, owner_refusal)
 
-        # if only the target has an owner
-        elif target_owner:
-            # interaction type is an Enum, so need it's value as string
-            consent_message = getattr(action.consent, f"owner_{interaction_type.value}")
+        def target_prompt() -> ConsentPrompt:
+            consent_message = getattr(action.consent, interaction_type.value)
             consent_message = f"{consent_message} {const.CONSENT_QUESTION}"
             consent_message = strings.format_string(
                 consent_message,
-                owner=target_owner.mention,
-                invoker_member=f"**{invoker_member.display_name}**",
-                target_member=f"**{target_member.display_name}**",
+                invoker_member=invoker_name,
+                target_member=target_member.mention,
             )
-            self.logger.debug(f'consent_message : "{consent_message}"')
-            await ctx.send(consent_message)
-
-            # wait for response from owner
-            pred = ExtendedMessagePredicate.yes_or_no(ctx, ctx.channel, target_owner)
-            try:
-                await self.bot.wait_for("message", timeout=const.TIMEOUT, check=pred)
-            except asyncio.TimeoutError:
-                await ctx.send(
-                    const.TIMEOUT_MESSAGE.format(
-                        user=f"**{target_owner.display_name}**"
-                    )
-                )
-                return False
+            refusal_message = strings.format_string(
+                const.REFUSAL_MESSAGE, target_member=target_name
+            )
+            return ConsentPrompt(consent_message, [target_member], refusal_message)
 
-            # if the owner declines consent, send this message
-            if not pred.result:
-                refusal_message = const.OWNER_REFUSAL_MESSAGE.format(
-                    owner=target_owner.display_name,
-                    invoker_member=f"**{invoker_member.display_name}**",
-                    target_member=f"**{target_member.display_name}**",
-                )
-                await ctx.send(refusal_message)
-                return False
-            # we can return True here as the owner has given consent
-            else:
-                return True
-
-        # Otherwise, no owners are involved and we ask the target member for consent
-        # interaction type is an Enum, so need it's value as string
-        consent_message = getattr(action.consent, interaction_type.value)
-        consent_message = f"{consent_message} {const.CONSENT_QUESTION}"
-        consent_message = strings.format_string(
-            consent_message,
-            invoker_member=f"**{invoker_member.display_name}**",
-            target_member=target_member.mention,
-        )
-        self.logger.debug(f'consent_message : "{consent_message}"')
-        await ctx.send(consent_message)
+        # if both invoker and target have owners, ask both for permission
+        if invoker_owner and target_owner:
+            prompts = [owner_prompt([invoker_owner, target_owner])]
+        # if only the target has an owner, their owner answers for them
+        elif target_owner:
+            prompts = [owner_prompt([target_owner])]
+        # otherwise ask the target, and the invoker's owner if they have one
+        else:
+            prompts = []
+            if invoker_owner and invoker_owner != target_member:
+                prompts.append(owner_prompt([invoker_owner]))
+            prompts.append(target_prompt())
 
-        # wait for response from target member
-        pred = ExtendedMessagePredicate.yes_or_no(ctx, ctx.channel, target_member)
+        for prompt in prompts:
+            self.logger.debug(f'consent_message : "{prompt.message}"')
+
+        # the prompts are sent in order and answered within the same timeout
         try:
-            await self.bot.wait_for("message", timeout=const.TIMEOUT, check=pred)
-        except asyncio.TimeoutError:
+            return await self.consent.request(ctx, prompts)
+        except ConsentLimitReached as e:
+            self.logger.debug(f"Consent request denied: {e}")
             await ctx.send(
-                const.TIMEOUT_MESSAGE.format(user=f"**{target_member.display_name}**")
-            )
-            return False
-
-        if not pred.result:
-            refusal_message = const.REFUSAL_MESSAGE.format(
-                target_member=f"**{target_member.display_name}**"
+                "There are too many roleplay requests waiting for an answer. "
+                "Try again later.",
+                delete_after=const.SHORT_DELETE_TIME,
             )
-            await ctx.send(refusal_message)
             return False
-        else:
-            return True
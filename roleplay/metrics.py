@@ -0,0 +1,150 @@
+"""Latency metrics for roleplay interactions
+
+Each stage of an interaction (reading settings, checks, owner lookups, waiting for
+consent, getting the image and sending the message) is timed with a span and recorded
+in a histogram per action and per stage. The histograms use fixed, exponentially
+growing buckets, so they take the same memory no matter how many interactions are
+recorded, and percentiles are estimated from the bucket counts.
+"""
+
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+# bucket upper bounds in seconds, from 0.1 ms growing by 20% up to about 10 minutes
+BUCKETS: List[float] = [0.0001 * 1.2**i for i in range(87)]
+
+
+class Histogram:
+    """Counts of observed durations in exponential buckets.
+
+    Attributes:
+        counts (List[int]): Number of observations in each bucket, plus one overflow
+            bucket for anything over the largest bound.
+        count (int): Total number of observations.
+        total (float): Sum of the observations in seconds.
+        max (float): The largest observation in seconds.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent: float) -> float:
+        """Estimate a percentile in seconds, interpolating inside its bucket.
+
+        Args:
+            percent (float): The percentile to estimate, e.g. 95.
+
+        Returns:
+            float: The estimated duration, or 0.0 if nothing was observed.
+        """
+        if not self.count:
+            return 0.0
+
+        rank = self.count * percent / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = BUCKETS[index - 1] if index else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else self.max
+                estimate = lower + (upper - lower) * (rank - seen) / count
+                return min(estimate, self.max)
+            seen += count
+        return self.max
+
+    def buckets(self) -> List[Tuple[float, int]]:
+        """Get the cumulative count at each bucket bound, like a Prometheus histogram."""
+        cumulative = []
+        seen = 0
+        for bound, count in zip(BUCKETS + [float("inf")], self.counts):
+            seen += count
+            cumulative.append((bound, seen))
+        return cumulative
+
+
+class Metrics:
+    """Histograms of interaction latency, by action and stage.
+
+    Every observation is recorded for its action and for ALL, so stages can be
+    compared across every action as well as for a single one.
+    """
+
+    ALL = "*"
+    SETTINGS = "settings"
+    CHECKS = "checks"
+    OWNERS = "owners"
+    CONSENT = "consent"
+    IMAGE = "image"
+    SEND = "send"
+    TOTAL = "total"
+    STAGES = (SETTINGS, CHECKS, OWNERS, CONSENT, IMAGE, SEND, TOTAL)
+
+    def __init__(self):
+        # {(action name, stage): Histogram}
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.started = time.time()
+
+    def observe(self, action_name: str, stage: str, seconds: float):
+        for key in ((action_name, stage), (self.ALL, stage)):
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def span(self, action_name: str, stage: str) -> Iterator[None]:
+        """Time the code in the with block as a stage of an action."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(action_name, stage, time.perf_counter() - start)
+
+    def get(self, action_name: str, stage: str) -> Histogram:
+        return self.histograms.get((action_name, stage)) or Histogram()
+
+    def actions(self) -> List[str]:
+        """Get the names of the actions that have been recorded."""
+        return sorted({name for name, _ in self.histograms if name != self.ALL})
+
+    def export(self) -> Dict[str, Dict[str, dict]]:
+        """Get every histogram as plain data, e.g. to send to a metrics system.
+
+        Returns:
+            Dict[str, Dict[str, dict]]: {action: {stage: {"count", "sum", "buckets"}}}
+        """
+        exported: Dict[str, Dict[str, dict]] = {}
+        for (action_name, stage), histogram in self.histograms.items():
+            exported.setdefault(action_name, {})[stage] = {
+                "count": histogram.count,
+                "sum": histogram.total,
+                "buckets": histogram.buckets(),
+            }
+        return exported
+
+    def reset(self):
+        self.histograms.clear()
+        self.started = time.time()
+
+    @staticmethod
+    def format_table(label: str, rows: List[Tuple[str, Histogram]]) -> str:
+        """Format histograms as a table of their count and p50/p95/p99 in ms."""
+        width = max([len(label)] + [len(name) for name, _ in rows])
+        lines = [f"{label:<{width}} {'count':>7} {'p50':>9} {'p95':>9} {'p99':>9}"]
+        for name, histogram in rows:
+            p50, p95, p99 = (histogram.percentile(p) * 1000 for p in (50, 95, 99))
+            lines.append(
+                f"{name:<{width}} {histogram.count:>7} {p50:>9.1f} {p95:>9.1f} "
+                f"{p99:>9.1f}"
+            )
+        return "\n".join(lines)
@@ -65,7 +65,9 @@ class Settings:
         self.logger.debug(f"default_user:\n{default_user}")
         self.config.register_user(**default_user)
 
-        self.users_manager = Manager(self.bot, self.config)
+        self.users_manager = Manager(
+            self.bot, self.config, self.parent.consent_dispatcher
+        )
 
         # Dynamically create commands based on USER_SETTINGS\
         self.create_setting_commands()
@@ -260,7 +262,7 @@ class Settings:
             if not member:
                 member = ctx.author
 
-            cur_state = await self.config.user(member).get_attr(property)()
+            cur_state = await self.users_manager.get_value(member, property)
             label = values["label"]
 
             # if a new state wasn't supplied, just show the current state
@@ -271,7 +273,7 @@ class Settings:
                     msg = f"{member.display_name} is not {get_indefinite_article(label)} {label}."
                 return await ctx.send(msg)
 
-            await self.config.user(member).get_attr(property).set(state)
+            await self.users_manager.set_value(member, property, state)
             return await ctx.send(
                 f"{member.display_name} is now {get_indefinite_article(label)} {label}."
                 if state
@@ -333,6 +335,7 @@ class Settings:
         avatar = await self.users_manager.get_member_avatar(ctx, member)
         embed.set_thumbnail(url=avatar)
 
+        snapshot = await self.users_manager.get_snapshot(member)
         for property, values in USER_SETTINGS.items():
             default = values.get("default")
             data_type = type(default)
@@ -344,7 +347,7 @@ class Settings:
                 )
                 embed.add_field(name=label, value=users, inline=True)
             elif data_type is bool:
-                bool_value = await self.config.user(member).get_attr(property)()
+                bool_value = snapshot.get(property)
                 value = const.TRUE_EMOJI if bool_value else const.FALSE_EMOJI
                 embed.add_field(name=f"{label} {value}", value="", inline=False)
             else:
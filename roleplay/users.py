@@ -10,16 +10,19 @@ Classes:
 
 import asyncio
 import logging
-from dataclasses import dataclass
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
 from random import choice
-from typing import List, Optional, Union
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
 import discord
 from redbot.core import commands
 
 from . import const
+from .graph import RelationshipGraph
 from .user_settings import USER_SETTINGS
-from .unicornia.predicates import ExtendedMessagePredicate
+from .unicornia.consent import ConsentDispatcher
 from .unicornia.strings import get_indefinite_article
 
 
@@ -41,6 +44,232 @@ PRONOUN_ROLES = {
 }
 
 
+@dataclass
+class UserSnapshot:
+    """A member's roleplay settings, read from Config in a single call.
+
+    Attributes:
+        member (discord.Member): The member the settings belong to.
+        settings (Dict[str, Any]): All of the member's settings, keyed by property.
+        groups (Dict[str, Set[int]]): The member's users groups as sets of user IDs.
+    """
+
+    member: discord.Member
+    settings: Dict[str, Any]
+    groups: Dict[str, Set[int]] = field(default_factory=dict)
+
+    def get(self, property: str) -> Any:
+        """Get a setting, falling back to its default."""
+        if property in self.settings:
+            return self.settings[property]
+        return USER_SETTINGS[property].get("default")
+
+    def in_group(self, user_or_id: Union[discord.User, int], users_group: str) -> bool:
+        """Checks if a user is in one of the member's users groups."""
+        user_id = getattr(user_or_id, "id", user_or_id)
+        if users_group in self.groups:
+            return user_id in self.groups[users_group]
+        return user_id in (self.get(users_group) or [])
+
+    @property
+    def owner_id(self) -> Optional[int]:
+        """ID of the member's owner, if they have one."""
+        owners = self.get("owners")
+        return owners[0] if owners else None
+
+
+class SettingsCache:
+    """Write-through cache of the roleplay settings of each user.
+
+    A user's settings are read from Config the first time they're needed and kept in
+    memory, so checking them never touches the Config driver. Writes go to Config
+    first and then replace the cached settings. Cached settings are never changed in
+    place, so snapshots taken before a write stay as they were.
+
+    Attributes:
+        config (Config): The configuration object the settings are stored in.
+        graph (RelationshipGraph): The users groups of every cached user, kept in sync
+            with every write.
+    """
+
+    def __init__(self, config):
+        self.config = config
+
+        # {user ID: settings}
+        self.settings: Dict[int, Dict[str, Any]] = {}
+        # {user ID: {users group: set of user IDs}}
+        self.groups: Dict[int, Dict[str, Set[int]]] = {}
+        # serializes the writes to a user's settings
+        self.locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self.graph = RelationshipGraph()
+
+    def store(self, user_id: int, settings: Dict[str, Any]):
+        self.settings[user_id] = settings
+        self.groups[user_id] = {
+            property: set(value)
+            for property, value in settings.items()
+            if isinstance(value, list)
+        }
+        self.graph.set_user(user_id, self.groups[user_id])
+
+    async def load_all(self):
+        """Read every user's settings from Config at once, building the graph."""
+        all_users = await self.config.all_users()
+        for user_id, settings in all_users.items():
+            # settings cached meanwhile may have been written since
+            if user_id not in self.settings:
+                self.store(user_id, settings)
+        self.graph.loaded = True
+
+    async def load(self, user_id: int) -> Dict[str, Any]:
+        """Get a user's settings, reading them from Config if they aren't cached."""
+        if user_id not in self.settings:
+            settings = await self.config.user_from_id(user_id).all()
+            # a write that finished while this was reading is more recent
+            if user_id not in self.settings:
+                self.store(user_id, settings)
+        return self.settings[user_id]
+
+    async def get_snapshot(self, member: discord.Member) -> UserSnapshot:
+        await self.load(member.id)
+        return UserSnapshot(
+            member=member,
+            settings=self.settings[member.id],
+            groups=self.groups[member.id],
+        )
+
+    async def set_value(self, user_id: int, property: str, value: Any):
+        """Write a setting to Config, then to the cache."""
+        async with self.locks[user_id]:
+            await self.write(user_id, property, value)
+
+    async def write(self, user_id: int, property: str, value: Any):
+        """Write a setting to Config, then to the cache, with the user's lock held."""
+        await self.config.user_from_id(user_id).get_attr(property).set(value)
+        # copy the settings after the write, so nothing written meanwhile is lost
+        settings = dict(await self.load(user_id))
+        settings[property] = value
+        self.store(user_id, settings)
+
+    async def add_to_group(
+        self, user_id: int, users_group: str, member_id: int
+    ) -> bool:
+        """Add a user ID to a users group. Returns False if it was already in it."""
+        async with self.locks[user_id]:
+            user_ids = list((await self.load(user_id)).get(users_group) or [])
+            if member_id in user_ids:
+                return False
+            user_ids.append(member_id)
+            await self.write(user_id, users_group, user_ids)
+            return True
+
+    async def remove_from_group(
+        self, user_id: int, users_group: str, member_id: int
+    ) -> bool:
+        """Remove a user ID from a users group. Returns False if it wasn't in it."""
+        async with self.locks[user_id]:
+            user_ids = list((await self.load(user_id)).get(users_group) or [])
+            if member_id not in user_ids:
+                return False
+            user_ids.remove(member_id)
+            await self.write(user_id, users_group, user_ids)
+            return True
+
+
+class MemberCache:
+    """Resolves guild members without a REST call whenever possible.
+
+    Members are looked up in the gateway cache first, then in a cache of members that
+    were fetched recently. Only members that are in neither are fetched from Discord,
+    and lookups for a member that's already being fetched share that request.
+
+    Attributes:
+        ttl (float): Seconds a fetched member is kept for.
+        max_size (int): Maximum number of fetched members kept.
+    """
+
+    TTL = 300
+    MAX_SIZE = 1024
+
+    def __init__(self, ttl: float = TTL, max_size: int = MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+
+        # {(guild ID, user ID): (expiry time, member or None if not in the guild)}
+        self.members: "OrderedDict[Tuple[int, int], tuple]" = OrderedDict()
+        # fetches in progress, so concurrent lookups for a member share one request
+        self.pending: Dict[Tuple[int, int], asyncio.Future] = {}
+
+    async def resolve(
+        self, guild: discord.Guild, user_id: int
+    ) -> Optional[discord.Member]:
+        """
+        Gets a member of a guild.
+
+        Args:
+            guild (discord.Guild): The guild the member is in.
+            user_id (int): Discord user ID of the member.
+
+        Returns:
+            Optional[discord.Member]: The member, or None if they aren't in the guild.
+        """
+        member = guild.get_member(user_id)
+        if member is not None:
+            return member
+
+        key = (guild.id, user_id)
+        cached = self.members.get(key)
+        if cached is not None:
+            expires, member = cached
+            if expires > time.monotonic():
+                return member
+            del self.members[key]
+
+        # another command is already fetching this member
+        while key in self.pending:
+            future = self.pending[key]
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # only this command was cancelled, not the fetch
+                if not future.cancelled():
+                    raise
+                # the command fetching it was cancelled, fetch it here instead
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        try:
+            try:
+                member = await guild.fetch_member(user_id)
+            except discord.NotFound:
+                member = None
+        except Exception as e:
+            future.set_exception(e)
+            # the exception is raised below, don't warn if nobody else was waiting
+            future.exception()
+            raise
+        else:
+            self.add(key, member)
+            future.set_result(member)
+            return member
+        finally:
+            del self.pending[key]
+            # cancelled, so wake the commands waiting on this fetch instead of
+            # leaving them waiting forever
+            if not future.done():
+                future.cancel()
+
+    def add(self, key: Tuple[int, int], member: Optional[discord.Member]):
+        self.members[key] = (time.monotonic() + self.ttl, member)
+        self.members.move_to_end(key)
+        while len(self.members) > self.max_size:
+            self.members.popitem(last=False)
+
+    def invalidate(self, guild_id: int, user_id: int):
+        """Forget a fetched member, e.g. when they join or leave the guild."""
+        self.members.pop((guild_id, user_id), None)
+
+
 class Manager:
     """
     This class manages lists of Discord User IDs in a member's config property.
@@ -59,23 +288,50 @@ class Manager:
         has_role(ctx, member, role_id): Checks if a member has a specific role by ID.
     """
 
-    def __init__(self, bot: commands.Bot, config):
+    # groups a user is removed from by purge_user(), blocks are kept in case they
+    # come back
+    PURGE_GROUPS = ("owners", "allowed")
+
+    def __init__(self, bot: commands.Bot, config, dispatcher: ConsentDispatcher):
         """Subclass to manager user data
 
         Args:
             bot (commands.Bot): The instance of the Redbot bot.
             config (Config): The configuration object for managing settings.
+            dispatcher (ConsentDispatcher): Routes yes/no answers to permission asks.
         """
         self.init_logging()
 
         self.bot = bot
         self.config = config
+        self.dispatcher = dispatcher
+        self.cache = SettingsCache(config)
+        self.member_cache = MemberCache()
 
     def init_logging(self):
         """Sets up logging for the Manager class."""
         self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
         self.logger.setLevel(const.LOGGER_LEVEL)
 
+    async def get_snapshot(self, member: discord.Member) -> UserSnapshot:
+        """
+        Gets all of a member's settings, reading them from Config in a single call if
+        they aren't cached yet.
+
+        Args:
+            member (discord.Member): Discord member to read the settings of.
+
+        Returns:
+            UserSnapshot: The member's settings.
+        """
+        return await self.cache.get_snapshot(member)
+
+    async def get_snapshots(self, *members: discord.Member) -> Tuple[UserSnapshot, ...]:
+        """Reads the settings of several members at the same time."""
+        return tuple(
+            await asyncio.gather(*(self.get_snapshot(member) for member in members))
+        )
+
     async def in_group(
         self,
         member: discord.Member,
@@ -98,10 +354,53 @@ class Manager:
             user_or_id.id if isinstance(user_or_id, discord.Member) else user_or_id
         )
 
-        async with self.config.user(member).get_attr(users_group)() as user_ids:
-            in_group = user_id in user_ids
-            self.logger.debug(f"{user_id} in {member} group {users_group}: {in_group}")
-            return in_group
+        snapshot = await self.get_snapshot(member)
+        in_group = snapshot.in_group(user_id, users_group)
+        self.logger.debug(f"{user_id} in {member} group {users_group}: {in_group}")
+        return in_group
+
+    @property
+    def graph(self) -> RelationshipGraph:
+        return self.cache.graph
+
+    async def load_graph(self):
+        """Build the relationship graph from every user's settings, if it isn't yet.
+
+        The cog builds it when it loads. Anything that needs every user's edges calls
+        this first in case that hasn't finished.
+        """
+        if self.graph.loaded:
+            return
+        await self.cache.load_all()
+        self.logger.debug(
+            f"Relationship graph built from {len(self.cache.settings)} users' settings."
+        )
+
+    async def purge_user(self, user_id: int) -> int:
+        """Remove a user from the PURGE_GROUPS of everyone who has them in one.
+
+        Args:
+            user_id (int): ID of the user to remove.
+
+        Returns:
+            int: The number of users groups the user was removed from.
+        """
+        # reverse lookups only find everyone once the graph is loaded
+        await self.load_graph()
+        removed = 0
+        for users_group in self.PURGE_GROUPS:
+            for member_id in self.graph.get_reverse(user_id, users_group):
+                if await self.cache.remove_from_group(member_id, users_group, user_id):
+                    removed += 1
+        return removed
+
+    async def get_value(self, member: discord.Member, property: str) -> Any:
+        """Gets one of a member's settings."""
+        return (await self.get_snapshot(member)).get(property)
+
+    async def set_value(self, member: discord.Member, property: str, value: Any):
+        """Sets one of a member's settings."""
+        await self.cache.set_value(member.id, property, value)
 
     async def add_user(
         self,
@@ -133,66 +432,73 @@ class Manager:
             return
 
         label = USER_SETTINGS[users_group].get("label", "users list")
+        user_ids = await self.get_value(member, users_group)
 
-        async with self.config.user(member).get_attr(users_group)() as user_ids:
-            # members are only allowed to have 1 owner
-            if users_group == "owners" and user_ids:
-                # reduce user_list down to single/first user id
-                if len(user_ids) > 1:
-                    user_ids = user_ids[:1]
-                return await ctx.send(
-                    f"{member.display_name} already has {get_indefinite_article(label)} {label}. {choice(const.INSULTS)}",
-                    delete_after=const.SHORT_DELETE_TIME,
+        # members are only allowed to have 1 owner
+        if users_group == "owners" and user_ids:
+            return await ctx.send(
+                f"{member.display_name} already has {get_indefinite_article(label)} {label}. {choice(const.INSULTS)}",
+                delete_after=const.SHORT_DELETE_TIME,
+            )
+
+        # owners can't be owned by someone they own, directly or down the chain
+        if users_group == "owners":
+            await self.load_graph()
+        if users_group == "owners" and self.graph.creates_owner_cycle(
+            member.id, user_id
+        ):
+            return await ctx.send(
+                f"{target_user.display_name} can't be {get_indefinite_article(label)} {label} for {member.display_name}, who already owns them. {choice(const.INSULTS)}",
+                delete_after=const.SHORT_DELETE_TIME,
+            )
+
+        # already in the list
+        if user_id in user_ids:
+            return await ctx.send(
+                f"{target_user.display_name} is already {get_indefinite_article(label)} {label} for {member.display_name}. {choice(const.INSULTS)}",
+                delete_after=const.SHORT_DELETE_TIME,
+            )
+
+        # get permission from the prospective member
+        if permission and permission.get("required"):
+            permission_ask = permission.get("permission_ask")
+            permission_accept = permission.get("permission_accept")
+            permission_deny = permission.get("permission_deny")
+
+            await ctx.send(
+                permission_ask.format(
+                    target=target_user.mention, author=member.display_name
                 )
+            )
 
-            # already in the list
-            if user_id in user_ids:
+            try:
+                accepted = await self.dispatcher.wait_for_answer(
+                    ctx.channel, target_user, timeout=const.TIMEOUT
+                )
+            except asyncio.TimeoutError:
                 return await ctx.send(
-                    f"{target_user.display_name} is already {get_indefinite_article(label)} {label} for {member.display_name}. {choice(const.INSULTS)}",
-                    delete_after=const.SHORT_DELETE_TIME,
+                    const.TIMEOUT_MESSAGE.format(user=target_user.display_name)
                 )
 
-            # get permission from the prospective member
-            if permission and permission.get("required"):
-                permission_ask = permission.get("permission_ask")
-                permission_accept = permission.get("permission_accept")
-                permission_deny = permission.get("permission_deny")
-
+            if accepted:
+                await self.cache.add_to_group(member.id, users_group, user_id)
                 await ctx.send(
-                    permission_ask.format(
-                        target=target_user.mention, author=member.display_name
+                    permission_accept.format(
+                        target=target_user.display_name, author=member.display_name
                     )
                 )
-
-                pred = ExtendedMessagePredicate.yes_or_no(ctx, ctx.channel, target_user)
-                try:
-                    await self.bot.wait_for(
-                        "message", timeout=const.TIMEOUT, check=pred
-                    )
-                except asyncio.TimeoutError:
-                    return await ctx.send(
-                        const.TIMEOUT_MESSAGE.format(user=target_user.display_name)
-                    )
-
-                if pred.result:
-                    user_ids.append(user_id)
-                    await ctx.send(
-                        permission_accept.format(
-                            target=target_user.display_name, author=member.display_name
-                        )
-                    )
-                else:
-                    return await ctx.send(
-                        permission_deny.format(
-                            target=target_user.display_name, author=member.display_name
-                        )
-                    )
             else:
-                user_ids.append(user_id)
                 return await ctx.send(
-                    f"{target_user.display_name} has been added as {get_indefinite_article(label)} {label} for {member.display_name}.",
-                    delete_after=const.SHORT_DELETE_TIME,
+                    permission_deny.format(
+                        target=target_user.display_name, author=member.display_name
+                    )
                 )
+        else:
+            await self.cache.add_to_group(member.id, users_group, user_id)
+            return await ctx.send(
+                f"{target_user.display_name} has been added as {get_indefinite_article(label)} {label} for {member.display_name}.",
+                delete_after=const.SHORT_DELETE_TIME,
+            )
 
     async def add_user_to_group(
         self,
@@ -275,19 +581,17 @@ class Manager:
             await ctx.send(f"User with ID {user_id} not found in this guild.")
             return
 
-        async with self.config.user(member).get_attr(users_group)() as user_ids:
-            if user_id not in user_ids:
-                await ctx.send(
-                    f"{user.display_name} is not in {get_indefinite_article(label)} {label} for {member.display_name}. {choice(const.INSULTS)}",
-                    delete_after=const.SHORT_DELETE_TIME,
-                )
-            else:
-                user_ids.remove(user_id)
-                label = USER_SETTINGS[users_group].get("label", "users list")
-                await ctx.send(
-                    f"{user.display_name} has been removed as {get_indefinite_article(label)} {label} for {member.display_name}.",
-                    delete_after=const.SHORT_DELETE_TIME,
-                )
+        label = USER_SETTINGS[users_group].get("label", "users list")
+        if not await self.cache.remove_from_group(member.id, users_group, user_id):
+            await ctx.send(
+                f"{user.display_name} is not in {get_indefinite_article(label)} {label} for {member.display_name}. {choice(const.INSULTS)}",
+                delete_after=const.SHORT_DELETE_TIME,
+            )
+        else:
+            await ctx.send(
+                f"{user.display_name} has been removed as {get_indefinite_article(label)} {label} for {member.display_name}.",
+                delete_after=const.SHORT_DELETE_TIME,
+            )
 
     async def remove_user_from_group(
         self, ctx, member: discord.Member, user_key: int, users_group: str
@@ -351,13 +655,13 @@ class Manager:
         Returns:
             Union[List[int], str]: List of user IDs or display names, or a newline delimited string.
         """
-        async with self.config.user(member).get_attr(users_group)() as user_ids:
-            if as_display:
-                return await self.convert_ids(user_ids, as_string=as_string)
-            if not user_ids:
-                return []
-            else:
-                return user_ids
+        user_ids = await self.get_value(member, users_group)
+        if as_display:
+            return await self.convert_ids(user_ids, as_string=as_string)
+        if not user_ids:
+            return []
+        else:
+            return list(user_ids)
 
     async def get_user(self, ctx, user_key: Union[int, str]):
         """Gets a user from various types
@@ -503,16 +807,50 @@ class Manager:
         else:
             return self.bot.user.id
 
+    async def resolve_member(
+        self, guild: Optional[discord.Guild], user_id: int
+    ) -> Optional[discord.Member]:
+        """
+        Gets a member of a guild from the gateway cache, the fetched members cache or
+        Discord, in that order.
+
+        Args:
+            guild (Optional[discord.Guild]): The guild the member is in.
+            user_id (int): Discord user ID of the member.
+
+        Returns:
+            Optional[discord.Member]: The member, or None if they aren't in the guild.
+        """
+        if guild is None:
+            return None
+        member = await self.member_cache.resolve(guild, user_id)
+        if member is None:
+            self.logger.debug(f"User {user_id} is not a member of {guild}.")
+        return member
+
     async def get_owner(
-        self, ctx: commands.Context, member: discord.Member
+        self,
+        ctx: commands.Context,
+        member: discord.Member,
+        snapshot: Optional[UserSnapshot] = None,
     ) -> discord.Member:
         """
         TODO: For now, just using the first owner in the users list. I'm not sure what
         we want to do if there multiples. Which owner should we ask for permission?
         All of them? First? Try to figure out who's online or active?
+
+        Args:
+            ctx (commands.Context): The context of the command invocation.
+            member (discord.Member): Discord member to get the owner of.
+            snapshot (Optional[UserSnapshot]): The member's settings, if they've
+            already been read.
         """
-        owners = await self.list_users(member, "owners")
-        owner = await ctx.guild.fetch_member(owners[0]) if owners else None
+        if snapshot is not None:
+            owner_id = snapshot.owner_id
+        else:
+            owners = await self.list_users(member, "owners")
+            owner_id = owners[0] if owners else None
+        owner = await self.resolve_member(ctx.guild, owner_id) if owner_id else None
         self.logger.debug(
             f"Attempted to get owner from {member}: {owner.display_name if owner else None}"
         )
@@ -0,0 +1,256 @@
+"""Warms up and validates the roleplay action images after the cog loads
+
+Every action image is checked once in the background: images that get uploaded
+(local files and spoilered URLs) are fetched into their caches and have their headers
+decoded, and images that are embedded by URL have just their first bytes requested.
+The size and dimensions of each image are recorded, images that can't be read are
+dropped from their action, and images over Discord's upload limit get a downscaled
+copy that's sent instead. Spoilered images are only fetched to the disk cache, so they
+don't push the images being sent out of memory. Actions that are reloaded are checked
+again on their own.
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import urlparse
+
+import aiohttp
+from PIL import Image, ImageFile, ImageSequence, UnidentifiedImageError
+
+from . import const
+from .actions import Action, ActionManager
+from .image_cache import ImageCache
+
+
+@dataclass
+class ImageInfo:
+    """What the warm-up found out about an action image.
+
+    Attributes:
+        size (Optional[int]): Size of the file in bytes, if known.
+        dimensions (Optional[Tuple[int, int]]): Width and height of the image.
+        format (Optional[str]): Image format reported by Pillow. e.g. "GIF"
+        variant (Optional[Path]): Downscaled copy to send instead, if the image is
+            over the upload limit.
+    """
+
+    size: Optional[int] = None
+    dimensions: Optional[Tuple[int, int]] = None
+    format: Optional[str] = None
+    variant: Optional[Path] = None
+
+
+class BrokenImage(Exception):
+    """Raised when an action image is missing or can't be decoded."""
+
+
+class ImageWarmer:
+    """Checks every action image and prepares downscaled copies of oversized ones.
+
+    Attributes:
+        action_manager (ActionManager): Holds the actions whose images are checked.
+        image_cache (ImageCache): Cache spoilered images are fetched into.
+        session (aiohttp.ClientSession): Session used to check embedded images.
+        variants_path (Path): Folder the downscaled copies are saved in.
+        upload_limit (int): Largest file size in bytes that can be attached.
+    """
+
+    CONCURRENCY = 4
+    TIMEOUT = 30
+    # bytes requested from embedded images, enough for Pillow to read the header
+    HEADER_BYTES = 64 * 1024
+    # status codes that mean an image is gone, rather than the host having trouble
+    MISSING_STATUSES = {404, 410}
+    # how much smaller each downscaling attempt makes the image
+    DOWNSCALE_STEP = 0.75
+    DOWNSCALE_ATTEMPTS = 4
+
+    def __init__(
+        self,
+        action_manager: ActionManager,
+        image_cache: ImageCache,
+        session: aiohttp.ClientSession,
+        variants_path: Path,
+        upload_limit: int = const.UPLOAD_LIMIT,
+    ):
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self.logger.setLevel(const.LOGGER_LEVEL)
+
+        self.action_manager = action_manager
+        self.image_cache = image_cache
+        self.session = session
+        self.variants_path = Path(variants_path)
+        self.upload_limit = upload_limit
+
+        # {image URL or file path: ImageInfo}
+        self.images: Dict[str, ImageInfo] = {}
+
+    def get_variant(self, image: str) -> Optional[Path]:
+        """Get the downscaled copy to send instead of an image, if it has one."""
+        info = self.images.get(image)
+        return info.variant if info else None
+
+    async def run(self, actions: Optional[Iterable[Action]] = None):
+        """Check the images of every action, or only of the given actions."""
+        if actions is None:
+            actions = self.action_manager.actions
+        start = time.perf_counter()
+        checked = 0
+        variants = 0
+        semaphore = asyncio.Semaphore(self.CONCURRENCY)
+
+        async def check(action: Action, image: str) -> bool:
+            nonlocal checked, variants
+            async with semaphore:
+                try:
+                    info = self.images[image] = await self.check_image(action, image)
+                except BrokenImage as e:
+                    self.logger.warning(f"{action.name} : Dropping {image}: {e}")
+                    return False
+                except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                    # the host may just be down for now, keep the image
+                    self.logger.debug(f"{action.name} : Unable to check {image}: {e}")
+                else:
+                    checked += 1
+                    variants += info.variant is not None
+                return True
+
+        for action in list(actions):
+            images = list(action.images)
+            valid = await asyncio.gather(*(check(action, image) for image in images))
+            working = [image for image, ok in zip(images, valid) if ok]
+            if not working:
+                self.logger.error(
+                    f"{action.name} : None of the images could be read, keeping them."
+                )
+            elif len(working) < len(images):
+                action.images = working
+
+        self.logger.info(
+            f"Checked {checked} action images in "
+            f"{time.perf_counter() - start:.1f}s ({variants} downscaled)."
+        )
+
+    async def check_image(self, action: Action, image: str) -> ImageInfo:
+        """Fetch or open an image, read its header and downscale it if needed."""
+        if urlparse(image).scheme not in ("http", "https"):
+            path = Path(image)
+        elif action.spoiler:
+            # spoilered images are uploaded from the image cache
+            try:
+                path = await self.image_cache.get(image, remember=False)
+            except aiohttp.ClientResponseError as e:
+                if e.status in self.MISSING_STATUSES:
+                    raise BrokenImage(f"{e.status} {e.message}")
+                raise
+        else:
+            # embedded images are never uploaded by the bot, Discord fetches them
+            return await self.check_url(image)
+
+        info = await asyncio.to_thread(self.read_header, path)
+        if info.size > self.upload_limit:
+            info.variant = await asyncio.to_thread(
+                self.get_downscaled, path, self.variants_path / action.name / path.name
+            )
+        return info
+
+    @staticmethod
+    def read_header(path: Path) -> ImageInfo:
+        """Read the size, dimensions and format of an image without decoding it."""
+        try:
+            size = path.stat().st_size
+            with Image.open(path) as image:
+                return ImageInfo(size=size, dimensions=image.size, format=image.format)
+        except (FileNotFoundError, UnidentifiedImageError) as e:
+            raise BrokenImage(str(e))
+
+    async def check_url(self, url: str) -> ImageInfo:
+        """Request the first bytes of an embedded image and read its header."""
+        timeout = aiohttp.ClientTimeout(total=self.TIMEOUT)
+        headers = {"Range": f"bytes=0-{self.HEADER_BYTES - 1}"}
+        try:
+            return await self.request_header(url, headers, timeout, ssl=None)
+        except aiohttp.ClientSSLError:
+            # put this here to resolve SSLError(SSLCertVerificationError with images
+            # on https://panel.unicornia.net
+            return await self.request_header(url, headers, timeout, ssl=False)
+
+    async def request_header(
+        self, url: str, headers: dict, timeout: aiohttp.ClientTimeout, ssl
+    ) -> ImageInfo:
+        async with self.session.get(
+            url, headers=headers, timeout=timeout, ssl=ssl
+        ) as response:
+            if response.status in self.MISSING_STATUSES:
+                raise BrokenImage(f"{response.status} {response.reason}")
+            response.raise_for_status()
+
+            # servers that ignore the range send the whole image, only read the start
+            data = b""
+            while len(data) < self.HEADER_BYTES:
+                chunk = await response.content.read(self.HEADER_BYTES - len(data))
+                if not chunk:
+                    break
+                data += chunk
+            content_range = response.headers.get("Content-Range", "")
+            if "/" in content_range and content_range.rsplit("/", 1)[1].isdigit():
+                size = int(content_range.rsplit("/", 1)[1])
+            else:
+                size = response.content_length
+
+        parser = ImageFile.Parser()
+        try:
+            parser.feed(data)
+        except OSError as e:
+            raise BrokenImage(str(e))
+        if parser.image is None:
+            raise BrokenImage("Not an image.")
+        return ImageInfo(
+            size=size, dimensions=parser.image.size, format=parser.image.format
+        )
+
+    def get_downscaled(self, source: Path, target: Path) -> Optional[Path]:
+        """Get a copy of an image that fits the upload limit, creating it if needed."""
+        if target.is_file() and target.stat().st_mtime >= source.stat().st_mtime:
+            return target
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with Image.open(source) as image:
+            scale = (self.upload_limit / source.stat().st_size) ** 0.5
+            for _ in range(self.DOWNSCALE_ATTEMPTS):
+                scale *= self.DOWNSCALE_STEP
+                self.save_downscaled(image, target, scale)
+                if target.stat().st_size <= self.upload_limit:
+                    self.logger.debug(f"Downscaled {source.name} by {scale:.2f}.")
+                    return target
+
+        target.unlink()
+        self.logger.warning(f"Unable to downscale {source} under the upload limit.")
+        return None
+
+    @staticmethod
+    def save_downscaled(image: Image.Image, target: Path, scale: float):
+        width, height = image.size
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+
+        mode = "RGB" if image.format == "JPEG" else "RGBA"
+        frames = []
+        durations = []
+        for frame in ImageSequence.Iterator(image):
+            durations.append(frame.info.get("duration", 100))
+            frames.append(frame.convert(mode).resize(size, Image.LANCZOS))
+
+        frames[0].save(
+            target,
+            format=image.format,
+            save_all=len(frames) > 1,
+            append_images=frames[1:],
+            duration=durations,
+            loop=image.info.get("loop", 0),
+            disposal=2,
+            optimize=True,
+        )
@@ -0,0 +1,84 @@
+"""Reloads roleplay action files when they change
+
+The action folder is polled for changed modification times and sizes. Only the files
+that changed are parsed again, and only their actions are swapped in the
+ActionManager, so editing an action doesn't need the cog to be reloaded.
+"""
+
+import asyncio
+import logging
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from . import const
+from .actions import Action, ActionManager
+
+
+class ActionWatcher:
+    """Polls the action files and reloads the ones that changed.
+
+    Attributes:
+        action_manager (ActionManager): Holds the actions that are reloaded.
+        on_change (Callable): Awaited with the action name and the new action, or None
+            if the action was removed, after an action changes.
+        interval (float): Seconds between checks of the action folder.
+    """
+
+    INTERVAL = 2.0
+
+    def __init__(
+        self,
+        action_manager: ActionManager,
+        on_change: Callable[[str, Optional[Action]], Awaitable[None]],
+        interval: float = INTERVAL,
+    ):
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self.logger.setLevel(const.LOGGER_LEVEL)
+
+        self.action_manager = action_manager
+        self.on_change = on_change
+        self.interval = interval
+
+        # {file path: (mtime_ns, size)} as of the last check
+        self.file_keys: Dict[Path, Tuple[int, int]] = {}
+
+    async def run(self):
+        """Check the action files until cancelled."""
+        # start from the files the actions were loaded from, so edits made while the
+        # bot was starting up are picked up too
+        self.file_keys = {
+            self.action_manager.DATA_PATH / name: entry["key"]
+            for name, entry in self.action_manager.files.items()
+        }
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception:
+                # keep watching, the next edit may fix whatever went wrong
+                self.logger.exception("Error reloading action files.")
+
+    async def check(self):
+        """Reload the action files that were added, changed or removed."""
+        file_keys = await asyncio.to_thread(self.action_manager.get_file_keys)
+
+        for file_path, file_key in file_keys.items():
+            if self.file_keys.get(file_path) == file_key:
+                continue
+            # remember the key first, so a file that can't be parsed isn't retried
+            # until it changes again
+            self.file_keys[file_path] = file_key
+            data = await asyncio.to_thread(self.action_manager.parse, file_path)
+            action = self.action_manager.replace(file_path, file_key, data)
+            if action is None:
+                self.logger.error(f"Unable to reload {file_path.name}, keeping it.")
+                continue
+            self.logger.info(f"Reloaded {file_path.name}.")
+            await self.on_change(action.name, action)
+
+        for file_path in set(self.file_keys) - set(file_keys):
+            del self.file_keys[file_path]
+            action = self.action_manager.remove(file_path)
+            if action is not None:
+                self.logger.info(f"Removed {action.name}, {file_path.name} is gone.")
+                await self.on_change(action.name, None)